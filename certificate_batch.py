@@ -0,0 +1,601 @@
+"""Batch certificate generation spread over a pool of worker processes.
+
+Each worker receives the layout (template, text areas and font settings) once
+through the pool initializer and then renders rows in chunks into a small
+pool of reused canvases, overlapping rendering, encoding and disk writes.
+"""
+import io, os, re, json, time, hashlib
+import queue, threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from PIL import Image
+
+from certificate_pdf import (OverlayPdfWriter, ShardedPdfWriter, StreamingPdfWriter,
+                             VectorPdfWriter, encode_jpeg, layout_template_jpeg)
+from certificate_data import RowSource
+from certificate_manifest import Manifest, file_entry
+from certificate_render import IncrementalRenderer, measure_rows, render_texts
+
+# Below this many rows a process pool costs more than it saves
+MIN_PARALLEL_ROWS = 8
+
+# Rows per call when rendering in-process: enough for the pipeline to overlap,
+# few enough for smooth progress updates
+SERIAL_CHUNK_ROWS = 8
+
+# Combined and sharded raster PDFs send each chunk's JPEG pages (1-4 MB each
+# for a photographic A4 template at 300 DPI) back to the parent; chunks are
+# sized so no more than this many pages are held there at once
+MAX_PAGES_IN_FLIGHT = 64
+
+# PDF backends whose pages are built from area texts rather than rendered images
+TEXT_PDF_WRITERS = {"vector": VectorPdfWriter, "overlay": OverlayPdfWriter}
+
+# Pillow PNG save options for each profile. "palette" maps every pixel to the
+# nearest entry of a fixed palette of the template's colours plus a text colour
+# ramp (within a few levels per channel; Pillow matches colours at 6 bits), and
+# falls back to "fast" for templates with too many colours for one palette.
+PNG_PROFILES = {
+    "default": {},
+    "fast": {'compress_level': 1},
+    "archival": {'optimize': True},
+    "palette": {},
+}
+
+# Palette budget: template colours, plus anti-aliasing steps from the text
+# colours to the template's background, shared between the text colours
+PALETTE_TEMPLATE_COLORS = 192
+PALETTE_TEXT_STEPS = 256 - PALETTE_TEMPLATE_COLORS
+
+def png_palette(layout):
+    """Palette image for the "palette" PNG profile, or None if the template has too many colours"""
+    colors = layout.template.convert("RGB").getcolors(PALETTE_TEMPLATE_COLORS)
+    if colors is None:
+        return None
+
+    colors = [color for count, color in sorted(colors, reverse=True)]
+    background = colors[0]
+    text_colors = list(dict.fromkeys(tuple(area.style.color)[:3] for area in layout.plan))
+    steps = max(2, PALETTE_TEXT_STEPS // max(1, len(text_colors)))
+    ramp = [tuple(t + (b - t) * i // (steps - 1) for t, b in zip(text, background))
+            for text in text_colors for i in range(steps)]
+    entries = list(dict.fromkeys(colors + ramp))[:256]
+    # Unused slots repeat the background, which never wins a nearest-colour tie
+    entries += [background] * (256 - len(entries))
+
+    palette = Image.new("P", (1, 1))
+    palette.putpalette([value for color in entries for value in color])
+    return palette
+
+def encode_png(img, profile="default", palette=None):
+    """PNG bytes for a rendered certificate using one of PNG_PROFILES"""
+    if profile not in PNG_PROFILES:
+        raise ValueError(f"Unknown PNG profile: {profile}")
+    if profile == "palette":
+        if palette is None:
+            profile = "fast"
+        else:
+            img = img.quantize(palette=palette, dither=Image.Dither.NONE)
+
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG", dpi=(300, 300), **PNG_PROFILES[profile])
+    return buffer.getvalue()
+
+def benchmark_png(layout, texts, repeat=3):
+    """Size and encode time of one rendered certificate in each PNG profile
+
+    Returns (profile, bytes, seconds) tuples; times are the best of repeat runs.
+    """
+    img = render_texts(layout, texts)
+    palette = png_palette(layout)
+    results = []
+    for profile in PNG_PROFILES:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = encode_png(img, profile, palette)
+            times.append(time.perf_counter() - start)
+        results.append((profile, len(data), min(times)))
+    return results
+
+def sanitize_filename(s):
+    """Clean filename for safe saving"""
+    s = str(s)
+    s = re.sub(r'[\\/:"*?<>|]+', '', s)
+    s = re.sub(r'\s+', '_', s.strip())
+    return s if s else "unnamed"
+
+def input_fingerprint(layout, options=()):
+    """Hash of everything shared by a batch's rows: the layout and output options"""
+    return hashlib.sha256((layout.fingerprint() + repr(tuple(options))).encode()).digest()
+
+def _unique_name(name, taken):
+    """name, or name_2, name_3, ... if an earlier row already has it
+
+    Compared case-insensitively, since Windows and macOS file names are.
+    """
+    candidate, n = name, 1
+    while candidate.casefold() in taken:
+        n += 1
+        candidate = f"{name}_{n}"
+    taken.add(candidate.casefold())
+    return candidate
+
+def _text_columns(data, columns):
+    """str() of each value in the given columns, one list per column, converted in bulk
+
+    Values read as data.iloc[i][column] would give them, so rows match the
+    editor's preview even where pandas upcasts a row (an int next to a float
+    column reads "3.0").
+    """
+    values = data.to_numpy()
+    if values.dtype.kind not in "biufc":
+        # numpy spells dates differently from pandas; go through the pandas objects
+        values = data.to_numpy(dtype=object)
+    strings = values.astype(str)
+    return [strings[:, data.columns.get_loc(column)].tolist() for column in columns]
+
+def _sanitize_names(names):
+    """sanitize_filename over a whole column of names"""
+    names = pd.Series(names, dtype=object)
+    names = names.str.replace(r'[\\/:"*?<>|]+', '', regex=True).str.strip()
+    names = names.str.replace(r'\s+', '_', regex=True)
+    return names.mask(names == "", "unnamed")
+
+def build_rows(data, layout, taken=None, fingerprint=b""):
+    """Turn a DataFrame (or a chunk of one) into (texts, safe_name, input_hash) tuples
+
+    Rows whose names sanitize to a filename an earlier row already has get
+    _2, _3, ... appended; pass the same taken set for every chunk of a roster
+    to keep names unique across chunks. input_hash covers the row's texts and
+    fingerprint (see input_fingerprint), and changes whenever either does.
+    Columns are converted and sanitized a whole chunk at a time.
+    """
+    taken = set() if taken is None else taken
+    if len(data) == 0:
+        return []
+    if data.shape[1] == 0:
+        names = _sanitize_names(["No data"] * len(data))
+        texts = [()] * len(data)
+    else:
+        # The name is read on its own (data.iloc[i, 0]), so never upcast with the row
+        names = _sanitize_names(_text_columns(data.iloc[:, [0]], data.columns[:1])[0])
+        columns = list(dict.fromkeys(area.column for area in layout.areas))
+        by_column = dict(zip(columns, _text_columns(data, columns)))
+        texts = (list(zip(*(by_column[area.column] for area in layout.areas)))
+                 if layout.areas else [()] * len(data))
+
+    # Most chunks have no repeated names; only those need the row-by-row pass
+    folded = names.str.casefold()
+    if folded.duplicated().any() or folded.isin(taken).any():
+        safe_names = [_unique_name(name, taken) for name in names]
+    else:
+        taken.update(folded)
+        safe_names = names.tolist()
+
+    base = hashlib.sha256(fingerprint)
+    rows = []
+    for row_texts, safe_name in zip(texts, safe_names):
+        digest = base.copy()
+        digest.update(json.dumps(row_texts).encode())
+        rows.append((row_texts, safe_name, digest.hexdigest()))
+    return rows
+
+def _batched(rows, size):
+    """Lists of up to size items from an iterable"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Per-process state set up once by _init_worker; emptied again after an in-process run
+_worker = {}
+
+# Rows each worker keeps in flight between its pipeline stages. Every row in
+# flight needs its own full-size canvas, so a worker that renders holds this
+# many copies of the template: about 26 MB each for an A4 page at 300 DPI,
+# so about 104 MB per worker.
+PIPELINE_DEPTH = 4
+
+def _init_worker(layout, output_dir, formats, pdf_mode, pdf_backend, png_profile="default"):
+    """Store the shared job settings in the worker process"""
+    # Text PDF backends without PNG output build pages from texts alone
+    renders = "png" in formats or ("pdf" in formats and pdf_backend not in TEXT_PDF_WRITERS)
+    _worker.clear()
+    _worker.update(buffers=BufferPool(layout, PIPELINE_DEPTH if renders else 0), layout=layout,
+                   output_dir=output_dir, formats=formats, pdf_mode=pdf_mode,
+                   pdf_backend=pdf_backend, png_profile=png_profile)
+    if "png" in formats and png_profile == "palette":
+        _worker['png_palette'] = png_palette(layout)
+    if pdf_backend in TEXT_PDF_WRITERS and pdf_mode == "per-row":
+        # Every per-row PDF embeds the same template bytes
+        _worker['template_jpeg'] = layout_template_jpeg(layout)
+
+class BufferPool:
+    """A fixed set of renderers, each with its own canvas, lent to pipeline stages
+
+    A rendered canvas stays untouched until every stage holding it has
+    released it, and then goes back on the free queue for a later row. Asking
+    for a buffer blocks while all of them are in use, which bounds how many
+    rendered rows exist at once.
+    """
+
+    def __init__(self, layout, size):
+        self._free = queue.Queue()
+        for _ in range(size):
+            self._free.put(IncrementalRenderer(layout))
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def render(self, texts, holders, placements=None):
+        """Render texts into a free buffer held by holders stages; returns (buffer, image)"""
+        buffer = self._free.get()
+        try:
+            img = buffer.render(texts, placements)
+        except BaseException:
+            self._free.put(buffer)
+            raise
+        with self._lock:
+            self._refs[buffer] = holders
+        return buffer, img
+
+    def release(self, buffer):
+        with self._lock:
+            self._refs[buffer] -= 1
+            done = self._refs[buffer] == 0
+        if done:
+            self._free.put(buffer)
+
+class Stage(threading.Thread):
+    """Pipeline stage: a thread applying fn to items from a bounded queue
+
+    After a failure the stage keeps draining its queue, still calling
+    cleanup(item) on each, so upstream stages never block on a full queue or
+    wait for a buffer that will not come back. finish() stops the thread and
+    returns the failure, if any.
+    """
+
+    _done = object()
+
+    def __init__(self, fn, depth, cleanup=None):
+        super().__init__(daemon=True)
+        self.fn = fn
+        self.cleanup = cleanup
+        self.queue = queue.Queue(depth)
+        self.error = None
+        self.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is Stage._done:
+                return
+            try:
+                if self.error is None:
+                    self.fn(item)
+            except BaseException as e:
+                self.error = e
+            finally:
+                if self.cleanup:
+                    self.cleanup(item)
+
+    def finish(self):
+        self.queue.put(Stage._done)
+        self.join()
+        return self.error
+
+def _render_rows(rows):
+    """Render and save a chunk of rows
+
+    Rendering, PDF encoding, PNG encoding and disk writes run as separate
+    threads connected by bounded queues, so encoding one row overlaps with
+    rendering the next and writing the previous one. A row that fails is
+    recorded and skipped rather than ending the chunk.
+
+    Returns (records, pages): a manifest record for every row, and what the
+    parent process needs to add each successful row to a combined PDF --
+    JPEG-encoded page images for the raster backend, or just the area texts
+    for the vector and overlay backends.
+    """
+    buffers = _worker['buffers']
+    output_dir = _worker['output_dir']
+    text_writer = TEXT_PDF_WRITERS.get(_worker['pdf_backend'])
+    want_pdf = "pdf" in _worker['formats']
+    want_png = "png" in _worker['formats']
+    records, pages = [], []
+
+    def fail(record, error):
+        record.setdefault('error', f"{type(error).__name__}: {error}")
+
+    def pdf_stage(job):
+        texts, safe_name, img, buffer, record, placements = job
+        if 'error' in record:
+            return
+        try:
+            name = f"{safe_name}.pdf"
+            if _worker['pdf_mode'] != "per-row":
+                pages.append(texts if text_writer else encode_jpeg(img))
+            elif text_writer:
+                # Small, and streamed straight to its file by the writer
+                with text_writer(os.path.join(output_dir, name), _worker['layout'],
+                                 template_jpeg=_worker['template_jpeg']) as pdf:
+                    pdf.add_texts(texts, placements)
+                record['outputs']['pdf'] = file_entry(output_dir, name)
+            else:
+                data = io.BytesIO()
+                img.save(data, "PDF", resolution=300.0, quality=100)
+                writer.put((name, data.getvalue(), "pdf", record))
+        except Exception as e:
+            fail(record, e)
+
+    def png_stage(job):
+        texts, safe_name, img, buffer, record, placements = job
+        if 'error' in record:
+            return
+        try:
+            data = encode_png(img, _worker['png_profile'], _worker.get('png_palette'))
+            writer.put((f"{safe_name}.png", data, "png", record))
+        except Exception as e:
+            fail(record, e)
+
+    def write_stage(item):
+        name, data, fmt, record = item
+        try:
+            with open(os.path.join(output_dir, name), "wb") as f:
+                f.write(data)
+            record['outputs'][fmt] = file_entry(output_dir, name, data)
+        except Exception as e:
+            fail(record, e)
+
+    def release(job):
+        if job[3] is not None:
+            buffers.release(job[3])
+
+    writer = Stage(write_stage, PIPELINE_DEPTH)
+    encoders = []
+    if want_pdf:
+        encoders.append(Stage(pdf_stage, PIPELINE_DEPTH, release))
+    if want_png:
+        encoders.append(Stage(png_stage, PIPELINE_DEPTH, release))
+    holders = len(encoders) if want_png or not text_writer else 0
+    # Pillow keeps a save's settings on the Image, so two encoders can't save
+    # one image at the same time; a raster PDF beside a PNG gets its own copy
+    shared = want_png and want_pdf and not text_writer
+
+    # Text drawn here is placed a chunk at a time, each distinct text measured once
+    draws_text = holders or (text_writer and _worker['pdf_mode'] == "per-row")
+    placed = (measure_rows(_worker['layout'].plan, [row[0] for row in rows]) if draws_text
+              else [None] * len(rows))
+
+    try:
+        for (texts, safe_name, input_hash), placements in zip(rows, placed):
+            if any(stage.error for stage in encoders + [writer]):
+                break
+            record = {'key': safe_name, 'input': input_hash, 'outputs': {}}
+            records.append(record)
+            try:
+                buffer, img = (buffers.render(texts, holders, placements) if holders
+                               else (None, None))
+            except Exception as e:
+                fail(record, e)
+                continue
+            for stage in encoders:
+                own = img.copy() if shared and stage.fn is pdf_stage else img
+                stage.put((texts, safe_name, own, buffer, record, placements))
+    finally:
+        # Encoders feed the writer, so they are drained first
+        errors = [stage.finish() for stage in encoders + [writer]]
+    for error in errors:
+        if error is not None:
+            raise error
+
+    for record in records:
+        record['status'] = "failed" if 'error' in record else "done"
+    return records, pages
+
+def _map_ordered(pool, fn, chunks, window, stop=None):
+    """Like pool.map, but with at most window chunks in flight
+
+    Results come back in submission order, which keeps combined PDF pages in
+    roster order, and finished-but-unconsumed results can't pile up in memory.
+    Once stop() is true no more chunks are submitted and those still queued
+    are cancelled, but chunks already running or done are still waited for
+    and yielded, so their work is not lost.
+    """
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(fn, chunk))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        if stop is not None and stop():
+            break
+    if stop is not None and stop():
+        for future in pending:
+            future.cancel()
+    while pending:
+        future = pending.popleft()
+        if not future.cancelled():
+            yield future.result()
+
+def open_pdf_output(output_dir, pdf_mode, pages_per_file=500, name="certificates",
+                    pdf_backend="raster", layout=None):
+    """Writer for combined PDF output, or None when every row gets its own file"""
+    if pdf_backend in TEXT_PDF_WRITERS:
+        writer, options = TEXT_PDF_WRITERS[pdf_backend], {'layout': layout}
+    elif pdf_backend == "raster":
+        writer, options = StreamingPdfWriter, {}
+    else:
+        raise ValueError(f"Unknown PDF backend: {pdf_backend}")
+
+    if pdf_mode == "combined":
+        return writer(os.path.join(output_dir, f"{name}.pdf"), **options)
+    if pdf_mode == "sharded":
+        return ShardedPdfWriter(output_dir, name, pages_per_file, writer, **options)
+    if pdf_mode != "per-row":
+        raise ValueError(f"Unknown PDF mode: {pdf_mode}")
+    return None
+
+def generate_batch(layout, data, output_dir="Certificates", formats=("pdf",),
+                   pdf_mode="per-row", pages_per_file=500, pdf_backend="raster", workers=None,
+                   chunk_size=None, progress=None, png_profile="default", resume=False,
+                   verify=False, prune=False, pause=None, cancel=None):
+    """Render and save every row of data, spreading chunks over worker processes
+
+    data is a DataFrame or a RowSource; a RowSource is read chunk by chunk
+    while earlier rows are already rendering, so the roster is never held in
+    memory at once. Rows whose file names collide get _2, _3, ... suffixes.
+    pdf_mode is "per-row" (one PDF per certificate), "combined" (one multi-page
+    certificates.pdf) or "sharded" (certificates_0001.pdf, ... of pages_per_file
+    pages each). Combined pages are streamed to disk in roster order; raster
+    pages waiting for their turn are capped at MAX_PAGES_IN_FLIGHT.
+    pdf_backend is "raster" (full-page JPEG per page, as Pillow writes it),
+    "vector" (one shared template image plus real text in the layout's font) or
+    "overlay" (the shared template plus each row's text as a small masked image,
+    looking exactly like raster output without re-encoding the page).
+    png_profile picks the PNG encoding trade-off, one of PNG_PROFILES.
+    progress, if given, is called as progress(done, total) in the calling
+    process; total is None while a streamed roster's length is unknown.
+
+    Every finished row is recorded in output_dir's manifest with a hash of its
+    inputs (texts, layout, font and colour settings, backend and PNG profile).
+    With resume, rows whose inputs are unchanged since they were last written
+    and whose files are still intact (same size and mtime, or same SHA-256
+    with verify) are skipped, so a rerun only regenerates what changed. A
+    combined or sharded PDF is rebuilt in full, so it needs every row rendered
+    again. prune deletes the outputs of rows no longer in data.
+    Rows that fail are recorded and the rest carry on; RuntimeError is raised
+    at the end if any failed. Returns the number of certificates written or
+    already complete.
+
+    pause and cancel are optional threading.Events for running a batch from
+    another thread: while pause is set no new rows are started, and once
+    cancel is set the run stops after the chunks in progress, keeping what is
+    finished so a resumed run picks up the rest (a combined PDF holds the
+    pages done so far). prune is skipped for a cancelled run.
+    """
+    if png_profile not in PNG_PROFILES:
+        raise ValueError(f"Unknown PNG profile: {png_profile}")
+    os.makedirs(output_dir, exist_ok=True)
+    source = data if isinstance(data, RowSource) else RowSource.from_frame(data)
+    total = source.total
+    workers = workers or os.cpu_count() or 1
+    job = (layout, output_dir, tuple(formats), pdf_mode, pdf_backend, png_profile)
+
+    manifest = Manifest(output_dir).load()
+    earlier = manifest.records
+    skip_complete = resume and not ("pdf" in formats and pdf_mode != "per-row")
+    fingerprint = input_fingerprint(layout, (pdf_backend, png_profile))
+    taken, keys = set(), set()
+    done = 0
+    failed = []
+
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    def pending_rows():
+        """Rows still to render, in roster order, as the source produces them"""
+        nonlocal done
+        for frame in source:
+            skipped = 0
+            for row in build_rows(frame, layout, taken, fingerprint):
+                while pause is not None and pause.is_set() and not cancelled():
+                    time.sleep(0.1)
+                if cancelled():
+                    done += skipped
+                    return
+                if prune:
+                    keys.add(row[1])
+                if skip_complete and manifest.is_complete(row[1], formats, row[2], verify):
+                    skipped += 1
+                else:
+                    yield row
+            if skipped:
+                done += skipped
+                if progress:
+                    progress(done, total)
+
+    def collect(result):
+        nonlocal done
+        records, pages = result
+        if pdf_backend in TEXT_PDF_WRITERS:
+            # Fonts don't travel between processes, so pages are placed here
+            for page, placements in zip(pages, measure_rows(layout.plan, pages)):
+                pdf.add_texts(page, placements)
+        else:
+            for page in pages:
+                pdf.add_jpeg(*page)
+        for record in records:
+            manifest.add(record)
+            if record['status'] == "failed":
+                failed.append(record)
+        done += len(records)
+        if progress:
+            progress(done, total)
+
+    pdf = None
+    manifest.open(fresh=not resume)
+    try:
+        if "pdf" in formats:
+            pdf = open_pdf_output(output_dir, pdf_mode, pages_per_file,
+                                  pdf_backend=pdf_backend, layout=layout)
+        if workers == 1 or (total is not None and total < MIN_PARALLEL_ROWS):
+            # Not worth starting processes; run the same code in-process
+            _init_worker(*job)
+            try:
+                for chunk in _batched(pending_rows(), SERIAL_CHUNK_ROWS):
+                    collect(_render_rows(chunk))
+                    if cancelled():
+                        break
+            finally:
+                # Don't keep the canvases and layout alive for the rest of the session
+                _worker.clear()
+        else:
+            if chunk_size is None:
+                chunk_size = max(1, min(64, total // (workers * 4))) if total else 16
+            window = workers * 2
+            if "pdf" in formats and pdf_mode != "per-row" and pdf_backend == "raster":
+                window = min(window, MAX_PAGES_IN_FLIGHT)
+                chunk_size = max(1, min(chunk_size, MAX_PAGES_IN_FLIGHT // window))
+            pool_size = min(workers, -(-total // chunk_size)) if total else workers
+
+            # spawn keeps workers clear of the parent's Tk state
+            pool = ProcessPoolExecutor(max_workers=pool_size,
+                                       mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_init_worker, initargs=job)
+            try:
+                chunks = _batched(pending_rows(), chunk_size)
+                for result in _map_ordered(pool, _render_rows, chunks, window, cancelled):
+                    collect(result)
+            finally:
+                pool.shutdown(cancel_futures=True)
+
+        if prune and not cancelled():
+            # Against the records from before this run, which a fresh run has dropped
+            manifest.prune(keys, earlier)
+    finally:
+        try:
+            if pdf is not None:
+                pdf.close()
+        finally:
+            manifest.close()
+
+    return _finish(done, failed)
+
+def _finish(total, failed):
+    """Number of certificates done, or RuntimeError naming the rows that failed"""
+    if failed:
+        first = failed[0]
+        raise RuntimeError(f"{len(failed)} of {total} certificates failed "
+                           f"(first: {first['key']}: {first['error']}). "
+                           f"Run again with resume to retry just those rows.")
+    return total
@@ -0,0 +1,153 @@
+"""Headless batch generation: template + data + saved layout, no Tk required.
+
+Usage:
+    python certificate_cli.py --template template.png --data roster.xlsx --layout layout.json
+    python certificate_cli.py --layout project.json
+
+A project saved from the editor records its template and roster, so
+--template and --data are only needed to override them.
+"""
+import os, sys, time
+import argparse
+
+from PIL import Image
+
+from certificate_batch import PNG_PROFILES, benchmark_png, generate_batch
+from certificate_data import RowSource, needed_columns, read_columns
+from certificate_fonts import font_registry, system_font_index
+from certificate_layout import load_project
+from certificate_manifest import Manifest
+from certificate_render import Layout, area_texts
+
+FORMATS = {"pdf": ("pdf",), "png": ("png",), "both": ("pdf", "png")}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate certificates without the editor")
+    parser.add_argument("--template", help="certificate template image (default: the project's)")
+    parser.add_argument("--data", help="Excel, CSV or Parquet file with one row per certificate "
+                                       "(default: the project's)")
+    parser.add_argument("--layout", "--project", dest="layout",
+                        help="project or layout file saved from the editor")
+    parser.add_argument("--output-dir", default="Certificates", help="where to write certificates")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="pdf", help="output format")
+    parser.add_argument("--pdf-mode", choices=["per-row", "combined", "sharded"], default="per-row",
+                        help="one PDF per row, one combined PDF, or combined PDFs split into shards")
+    parser.add_argument("--pdf-backend", choices=["raster", "vector", "overlay"], default="raster",
+                        help="full-page images, a shared template image with real text, "
+                             "or a shared template image with per-row text images")
+    parser.add_argument("--pages-per-file", type=int, default=500,
+                        help="pages in each file with --pdf-mode sharded")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--png-profile", choices=list(PNG_PROFILES), default="default",
+                        help="PNG encoding: zlib defaults, fast, archival (smallest lossless) "
+                             "or palette (quantized to the template's colours)")
+    parser.add_argument("--benchmark-png", action="store_true",
+                        help="compare PNG profile size and speed on the first row, then exit")
+    parser.add_argument("--resume", action="store_true",
+                        help="only generate rows that are new or changed since an earlier run "
+                             "in the output folder, or that it didn't finish")
+    parser.add_argument("--prune", action="store_true",
+                        help="delete certificates of rows no longer in the data")
+    parser.add_argument("--verify", action="store_true",
+                        help="with --resume, re-hash existing files instead of checking size and date")
+    parser.add_argument("--check", action="store_true",
+                        help="only check the output folder against its manifest, then exit")
+    args = parser.parse_args(argv)
+
+    if not args.check and not args.layout:
+        parser.error("the following arguments are required: --layout")
+    return args
+
+def check_output(output_dir):
+    """Re-hash every output recorded in the manifest and report damaged or failed rows"""
+    manifest = Manifest(output_dir).load()
+    if not manifest.records:
+        print(f"✗ No manifest found in {os.path.abspath(output_dir)}", file=sys.stderr)
+        return 1
+
+    problems = manifest.verify(deep=True)
+    for key, problem in problems:
+        print(f"✗ {key}: {problem}")
+    print(f"{len(manifest.records) - len({key for key, problem in problems})} of "
+          f"{len(manifest.records)} rows complete and intact")
+    return 1 if problems else 0
+
+def main(argv=None):
+    """Command line entry point"""
+    args = parse_args(argv)
+    if args.check:
+        return check_output(args.output_dir)
+
+    # Resolve fonts the same way the editor did when the layout was saved
+    font_registry.set_index(system_font_index())
+
+    project = load_project(args.layout)
+    text_areas, font_settings = project.text_areas, project.font_settings
+    template_path = args.template or project.template_path
+    data_path = args.data or project.data_path
+    missing = [f"--{name}" for name, path in (("template", template_path), ("data", data_path))
+               if not path]
+    if missing:
+        print(f"✗ The layout doesn't record a template or data file; pass {' and '.join(missing)}",
+              file=sys.stderr)
+        return 1
+    for path in (template_path, data_path):
+        if not os.path.exists(path):
+            print(f"✗ File not found: {path}", file=sys.stderr)
+            return 1
+    if not args.template and project.template_changed():
+        print(f"⚠ {os.path.basename(template_path)} has changed since the project was saved",
+              file=sys.stderr)
+
+    template = Image.open(template_path).convert("RGB")
+    columns = read_columns(data_path)
+    missing = [area['column'] for area in text_areas if area['column'] not in columns]
+    if missing:
+        print(f"✗ Columns missing from data: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    # Streamed in chunks; rendering starts before the whole file is read
+    data = RowSource.from_file(data_path, needed_columns(columns, text_areas))
+
+    print(f"Template: {os.path.basename(template_path)} ({template.width}x{template.height})")
+    rows = f"{data.total} rows" if data.total is not None else "rows streamed"
+    print(f"Data: {rows}, {len(text_areas)} text areas")
+
+    layout = Layout.from_settings(template, text_areas, font_settings, template_path=template_path)
+    if args.benchmark_png:
+        first = next(iter(data), None)
+        texts = (area_texts(layout, first.iloc[0]) if first is not None and len(first)
+                 else ("",) * len(layout.areas))
+        print(f"{'Profile':<10} {'Size':>12} {'Encode':>10}")
+        for profile, size, seconds in benchmark_png(layout, texts):
+            print(f"{profile:<10} {size / 1024:>9.1f} KB {seconds * 1000:>7.1f} ms")
+        return 0
+
+    def report(done, total):
+        elapsed = time.perf_counter() - start
+        rate = done / elapsed if elapsed else 0.0
+        print(f"\r{done}/{total if total is not None else '?'} rows ({rate:.1f} rows/s)",
+              end="", flush=True)
+
+    start = time.perf_counter()
+    try:
+        count = generate_batch(layout, data, args.output_dir, formats=FORMATS[args.format],
+                               pdf_mode=args.pdf_mode, pages_per_file=args.pages_per_file,
+                               pdf_backend=args.pdf_backend, png_profile=args.png_profile,
+                               resume=args.resume, verify=args.verify, prune=args.prune,
+                               workers=args.workers, progress=report)
+    except RuntimeError as e:
+        # Some rows failed; the rest are saved and recorded in the manifest
+        print()
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+
+    print()
+    print(f"✓ Generated {count} certificates in {elapsed:.1f}s "
+          f"({count / elapsed if elapsed else 0.0:.1f} rows/s)")
+    print(f"   Files saved in: {os.path.abspath(args.output_dir)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""Roster loading: only the columns a layout uses, cached between runs.
+
+Excel workbooks are read with python-calamine when it is installed (pip
+install python-calamine, several times faster), otherwise streamed row by row
+with openpyxl's read-only mode instead of pd.read_excel. CSV files are parsed
+with usecols, and Parquet files read just the requested columns. The parsed
+table is pickled into the application cache keyed by file path, size, mtime
+and columns, so opening the same roster again is a single file read.
+
+For batch runs, RowSource reads a roster in chunks instead, so generation
+starts on the first chunk and memory does not grow with the roster.
+
+Every reader returns object columns holding the values as the file stores
+them, with blanks as NaN. Letting pandas infer dtypes would make a text
+depend on its neighbours: an integer column with one blank cell reads as
+floats ("95.0"), but only in the chunk that holds the blank.
+"""
+import os, csv, hashlib
+
+import pandas as pd
+
+from certificate_fonts import cache_dir
+
+DATA_EXTENSIONS = ('.xlsx', '.xlsm', '.xls', '.csv', '.parquet')
+
+# Rows per chunk when streaming a roster
+CHUNK_ROWS = 1000
+
+# Bumped when the parsed form of a roster changes, so older cache entries are reread
+CACHE_VERSION = 2
+
+def _kind(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext == ".parquet":
+        return "parquet"
+    if ext == ".xls":
+        return "xls"
+    return "xlsx"
+
+def _header_names(header):
+    """Column names as pandas would give them: blanks become "Unnamed: i", repeats get .1, .2"""
+    names, seen = [], {}
+    for i, name in enumerate(header):
+        if name is None or name == "":
+            name = f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def _open_sheet(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ImportError("Reading Excel files needs openpyxl:\npip install openpyxl") from e
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    return workbook, workbook.worksheets[0]
+
+def _parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Reading Parquet files needs pyarrow:\npip install pyarrow") from e
+    return pq
+
+def _parquet_columns(path):
+    return list(_parquet().read_schema(path).names)
+
+def read_columns(path):
+    """Column names of a roster file, reading no more than its header"""
+    kind = _kind(path)
+    if kind == "csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            return _header_names(next(csv.reader(f), []))
+    if kind == "parquet":
+        return _parquet_columns(path)
+    if kind == "xls":
+        return list(pd.read_excel(path, nrows=0).columns)
+
+    workbook, sheet = _open_sheet(path)
+    try:
+        header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+    finally:
+        workbook.close()
+    return _header_names(header)
+
+def needed_columns(columns, text_areas):
+    """The columns a batch reads: the first (it names the files) and every area's column"""
+    needed = list(columns[:1])
+    for area in text_areas:
+        if area['column'] not in needed:
+            needed.append(area['column'])
+    return needed
+
+def _as_objects(df):
+    """df with every column as object dtype and missing values as NaN"""
+    df = df.astype(object)
+    return df.where(df.notna(), float('nan'))
+
+def _xlsx_frame(columns, values):
+    return _as_objects(pd.DataFrame(dict(zip(columns, values)), columns=columns, dtype=object))
+
+def _xlsx_chunks(path, columns, chunk_rows):
+    """DataFrames of up to chunk_rows rows, streamed from the first sheet"""
+    workbook, sheet = _open_sheet(path)
+    try:
+        rows = sheet.iter_rows(values_only=True)
+        header = _header_names(next(rows, ()))
+        if columns is None:
+            columns = header
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise ValueError(f"Columns not found: {', '.join(map(str, missing))}")
+        indices = [header.index(c) for c in columns]
+
+        values = [[] for _ in columns]
+        count = 0
+        for row in rows:
+            # Formatted but empty rows at the end of a sheet aren't data
+            if all(v is None for v in row):
+                continue
+            for out, i in zip(values, indices):
+                out.append(row[i] if i < len(row) else None)
+            count += 1
+            if count == chunk_rows:
+                yield _xlsx_frame(columns, values)
+                values = [[] for _ in columns]
+                count = 0
+        if count:
+            yield _xlsx_frame(columns, values)
+    finally:
+        workbook.close()
+
+def _read_xlsx(path, columns):
+    chunks = list(_xlsx_chunks(path, columns, CHUNK_ROWS))
+    if not chunks:
+        return pd.DataFrame(columns=columns if columns is not None else read_columns(path),
+                            dtype=object)
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+def _has_calamine():
+    try:
+        import python_calamine
+    except ImportError:
+        return False
+    return True
+
+def _read_table(path, columns):
+    kind = _kind(path)
+    if kind in ("xlsx", "xls") and _has_calamine():
+        df = pd.read_excel(path, engine="calamine", usecols=columns, dtype=object)
+    elif kind == "csv":
+        df = pd.read_csv(path, usecols=columns, dtype=object)
+    elif kind == "parquet":
+        df = _parquet().read_table(path, columns=columns).to_pandas(integer_object_nulls=True)
+    elif kind == "xls":
+        df = pd.read_excel(path, usecols=columns, dtype=object)
+    else:
+        return _read_xlsx(path, columns)
+    # usecols keeps file order; callers rely on the order they asked for
+    return _as_objects(df if columns is None else df[list(columns)])
+
+def _cache_paths(path, stat, columns):
+    folder = os.path.join(cache_dir(), "rosters")
+    source = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    version = hashlib.sha1(repr((CACHE_VERSION, stat.st_size, stat.st_mtime_ns, columns)).encode()).hexdigest()[:16]
+    return folder, source, os.path.join(folder, f"{source}_{version}.pkl")
+
+def load_table(path, columns=None, use_cache=True):
+    """Roster as a DataFrame with just the given columns (all if None), in that order
+
+    Results are cached per file version and column set; a changed file or a
+    different set of columns is read again, and older cache entries for the
+    same file are dropped.
+    """
+    columns = list(columns) if columns is not None else None
+    if not use_cache:
+        return _read_table(path, columns)
+
+    stat = os.stat(path)
+    folder, source, cache_path = _cache_paths(path, stat, columns)
+    try:
+        return pd.read_pickle(cache_path)
+    except Exception:
+        pass  # not cached yet, or an unreadable entry that is rewritten below
+
+    df = _read_table(path, columns)
+    try:
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+        for name in os.listdir(folder):
+            if name.startswith(source + "_") and os.path.join(folder, name) != cache_path:
+                os.remove(os.path.join(folder, name))
+    except OSError:
+        pass  # a read-only cache only costs the next open a re-read
+    return df
+
+class RowSource:
+    """A roster read lazily as DataFrame chunks of up to chunk_rows rows
+
+    Iterating starts a fresh read. total is the number of rows when it is
+    known without reading the data (a DataFrame, Parquet metadata),
+    otherwise None.
+    """
+
+    def __init__(self, chunks, total=None):
+        self._chunks = chunks
+        self.total = total
+
+    def __iter__(self):
+        return iter(self._chunks())
+
+    @classmethod
+    def from_frame(cls, df, chunk_rows=CHUNK_ROWS):
+        """Chunks of an already loaded DataFrame"""
+        return cls(lambda: (df.iloc[i:i + chunk_rows] for i in range(0, len(df), chunk_rows)),
+                   len(df))
+
+    @classmethod
+    def from_file(cls, path, columns=None, chunk_rows=CHUNK_ROWS):
+        """Stream the given columns of a roster file, in that order"""
+        columns = list(columns) if columns is not None else None
+        kind = _kind(path)
+
+        if kind == "csv":
+            def chunks():
+                for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_rows,
+                                         dtype=object):
+                    yield _as_objects(chunk if columns is None else chunk[columns])
+            return cls(chunks)
+
+        if kind == "parquet":
+            pq = _parquet()
+            def chunks():
+                parquet = pq.ParquetFile(path)
+                for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+                    yield _as_objects(batch.to_pandas(integer_object_nulls=True))
+            return cls(chunks, pq.ParquetFile(path).metadata.num_rows)
+
+        if kind == "xls":
+            # The old Excel format can't be streamed
+            return cls.from_frame(load_table(path, columns), chunk_rows)
+
+        # A sheet's recorded size counts the blank and formatting-only rows
+        # that get skipped, so the total is only known once it has been read
+        return cls(lambda: _xlsx_chunks(path, columns, chunk_rows))
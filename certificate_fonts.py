@@ -0,0 +1,360 @@
+"""Font lookup: resolve a family and style to a file once, then reuse loaded faces.
+
+Resolving a name can mean searching every font directory on disk, so it is
+done once per family/style. Loaded FreeType faces are cached per (path, size),
+which makes size changes while resizing text a dictionary lookup.
+
+The installed fonts are kept in an on-disk index (path, mtime, family, style,
+PostScript name) that is refreshed incrementally by directory mtime, so later
+launches load it instead of walking and parsing every font file again.
+"""
+import os, sys, json, struct
+import threading
+from dataclasses import dataclass
+
+from PIL import ImageFont
+
+# Well-known font files to try when a family/style name can't be loaded directly
+FONT_FILES = {
+    ("Times New Roman", "Regular"): ["times.ttf", "TimesNewRomanPSMT.ttf"],
+    ("Times New Roman", "Bold"): ["timesbd.ttf", "TimesNewRomanPS-BoldMT.ttf"],
+    ("Times New Roman", "Italic"): ["timesi.ttf", "TimesNewRomanPS-ItalicMT.ttf"],
+    ("Times New Roman", "Bold Italic"): ["timesbi.ttf", "TimesNewRomanPS-BoldItalicMT.ttf"],
+    ("Arial", "Regular"): ["arial.ttf", "ArialMT.ttf"],
+    ("Arial", "Bold"): ["arialbd.ttf", "Arial-BoldMT.ttf"],
+    ("Arial", "Italic"): ["ariali.ttf", "Arial-ItalicMT.ttf"],
+    ("Arial", "Bold Italic"): ["arialbi.ttf", "Arial-BoldItalicMT.ttf"],
+    ("Calibri", "Regular"): ["calibri.ttf"],
+    ("Calibri", "Bold"): ["calibrib.ttf"],
+    ("Calibri", "Italic"): ["calibrii.ttf"],
+    ("Calibri", "Bold Italic"): ["calibriz.ttf"],
+}
+
+@dataclass(frozen=True)
+class FontResolution:
+    """Where a family/style was found
+
+    path is the font file, or None when falling back to Pillow's built-in font,
+    and face the font's index inside a collection (.ttc). source says how it
+    was found: "index", "name", "file" or "default".
+    """
+    family: str
+    style: str
+    path: object
+    source: str
+    face: int = 0
+
+    @property
+    def is_default(self):
+        return self.path is None
+
+class FontRegistry:
+    """Resolves font names to files and caches loaded faces; safe to share between threads"""
+
+    def __init__(self, index=None):
+        self._index = index
+        self._resolved = {}
+        self._fonts = {}
+        self._lock = threading.Lock()
+
+    def set_index(self, index):
+        """Use an installed-font index for lookups before searching by file name"""
+        with self._lock:
+            self._index = index
+            self._resolved.clear()
+
+    def candidates(self, family, style):
+        """Names to try for a family/style, as (source, name) pairs"""
+        font_name = family
+        if style != "Regular":
+            font_name += f" {style}"
+        yield "name", font_name
+        for font_file in FONT_FILES.get((family, style), []):
+            yield "file", font_file
+
+    def resolve(self, family, style):
+        """Find the font file for a family/style, searching the disk only once"""
+        key = (family, style)
+        with self._lock:
+            resolution = self._resolved.get(key)
+        if resolution is not None:
+            return resolution
+
+        resolution = FontResolution(family, style, None, "default")
+        found = self._index.find(family, style) if self._index else None
+        if found:
+            resolution = FontResolution(family, style, found[0], "index", found[1])
+            with self._lock:
+                self._resolved[key] = resolution
+            return resolution
+
+        for source, name in self.candidates(family, style):
+            try:
+                # Pillow searches the system font folders and records the full path
+                found = ImageFont.truetype(name, 10)
+            except OSError:
+                continue
+            resolution = FontResolution(family, style, found.path, source)
+            break
+
+        with self._lock:
+            self._resolved[key] = resolution
+        return resolution
+
+    def load(self, path, size, face=0):
+        """Loaded face for a resolved path (None for Pillow's default) at a size"""
+        key = (path, size, face)
+        with self._lock:
+            font = self._fonts.get(key)
+        if font is not None:
+            return font
+
+        if path is None:
+            font = ImageFont.load_default()
+        else:
+            font = ImageFont.truetype(path, size, index=face)
+        with self._lock:
+            return self._fonts.setdefault(key, font)
+
+    def get(self, family, style, size):
+        """Loaded face for a family/style at a size"""
+        resolution = self.resolve(family, style)
+        return self.load(resolution.path, size, resolution.face)
+
+# Shared by the editor and the renderer in each process
+font_registry = FontRegistry()
+
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+def font_dirs():
+    """Font directories for this platform"""
+    if sys.platform == "win32":
+        return [
+            "C:/Windows/Fonts/",
+            os.path.expanduser("~/AppData/Local/Microsoft/Windows/Fonts/")
+        ]
+    elif sys.platform == "darwin":  # macOS
+        return [
+            "/System/Library/Fonts/",
+            "/Library/Fonts/",
+            os.path.expanduser("~/Library/Fonts/")
+        ]
+    else:  # Linux
+        return [
+            "/usr/share/fonts/",
+            "/usr/local/share/fonts/",
+            os.path.expanduser("~/.fonts/"),
+            os.path.expanduser("~/.local/share/fonts/")
+        ]
+
+def cache_dir():
+    """Per-user cache folder for this application"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~/AppData/Local"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "certificate_generator")
+
+# name table IDs, in order of preference for each field
+_FAMILY_IDS = (16, 1)
+_STYLE_IDS = (17, 2)
+_POSTSCRIPT_ID = 6
+
+def _decode_name(platform, encoding, raw):
+    if platform in (0, 3):
+        return raw.decode("utf-16-be", "replace")
+    if platform == 1 and encoding == 0:
+        return raw.decode("mac_roman", "replace")
+    return None
+
+def _read_name_table(f, offset):
+    """Map of name ID to string for the sfnt font starting at offset"""
+    f.seek(offset)
+    num_tables = struct.unpack(">4xH6x", f.read(12))[0]
+    records = f.read(16 * num_tables)
+    for i in range(num_tables):
+        tag, _, table_offset, _ = struct.unpack_from(">4sIII", records, 16 * i)
+        if tag == b"name":
+            break
+    else:
+        return {}
+
+    f.seek(table_offset)
+    _, count, string_offset = struct.unpack(">HHH", f.read(6))
+    entries = f.read(12 * count)
+    names = {}
+    for i in range(count):
+        platform, encoding, language, name_id, length, offset = \
+            struct.unpack_from(">6H", entries, 12 * i)
+        if name_id not in _FAMILY_IDS + _STYLE_IDS + (_POSTSCRIPT_ID,):
+            continue
+        # Prefer Windows US English, then any Windows/Unicode, then Mac
+        rank = (0 if (platform, language) == (3, 0x409) else
+                1 if platform in (0, 3) else 2)
+        if name_id in names and names[name_id][0] <= rank:
+            continue
+        f.seek(table_offset + string_offset + offset)
+        text = _decode_name(platform, encoding, f.read(length))
+        if text:
+            names[name_id] = (rank, text)
+    return {name_id: text for name_id, (rank, text) in names.items()}
+
+def read_font_names(path):
+    """(family, style, PostScript name) for every face in a font file"""
+    faces = []
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if header[:4] == b"ttcf":
+            count = struct.unpack(">I", header[8:12])[0]
+            offsets = struct.unpack(f">{count}I", f.read(4 * count))
+        else:
+            offsets = (0,)
+
+        for offset in offsets:
+            names = _read_name_table(f, offset)
+            family = next((names[i] for i in _FAMILY_IDS if i in names), None)
+            style = next((names[i] for i in _STYLE_IDS if i in names), "Regular")
+            faces.append((family, style, names.get(_POSTSCRIPT_ID)))
+    return faces
+
+# Names fonts give their upright, normal-weight face, most common first
+REGULAR_STYLES = ("Regular", "Book", "Normal", "Roman", "Plain")
+
+def style_sort_key(style):
+    """Order a family's styles: its regular face first, other upright faces, then italics"""
+    if style in REGULAR_STYLES:
+        return (0, REGULAR_STYLES.index(style), style)
+    lowered = style.lower()
+    return (2 if "italic" in lowered or "oblique" in lowered else 1, 0, style)
+
+class FontIndex:
+    """On-disk index of installed fonts, refreshed incrementally
+
+    A directory whose mtime has not changed since the last refresh reuses its
+    cached file list and font names without listing or parsing anything, so
+    only new or changed folders cost any work.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None, dirs=None):
+        self.path = path or os.path.join(cache_dir(), "font_index.json")
+        self.dirs = dirs if dirs is not None else font_dirs()
+        self._dirs = {}   # dir -> {'mtime', 'subdirs', 'files'}
+        self._fonts = {}  # file -> {'mtime', 'faces': [[family, style, postscript], ...]}
+        self._lookup = {}
+
+    def load(self):
+        """Read the saved index, if any; a missing or stale file just means a full refresh"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self._dirs, self._fonts = data['dirs'], data['fonts']
+        except (OSError, ValueError, KeyError):
+            self._dirs, self._fonts = {}, {}
+        self._build_lookup()
+        return self
+
+    def save(self):
+        """Write the index atomically"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'version': self.VERSION, 'dirs': self._dirs, 'fonts': self._fonts}, f)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """Bring the index up to date with the font directories; returns True if anything changed"""
+        dirs, fonts = {}, {}
+        stack = [os.path.normpath(d) for d in self.dirs if os.path.isdir(d)]
+
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+
+            cached = self._dirs.get(directory)
+            unchanged = cached is not None and cached['mtime'] == mtime
+            if unchanged:
+                subdirs, files = cached['subdirs'], cached['files']
+            else:
+                subdirs, files = [], []
+                try:
+                    for entry in os.scandir(directory):
+                        if entry.is_dir():
+                            subdirs.append(entry.path)
+                        elif entry.name.lower().endswith(FONT_EXTENSIONS):
+                            files.append(entry.path)
+                except OSError:
+                    continue
+
+            dirs[directory] = {'mtime': mtime, 'subdirs': subdirs, 'files': files}
+            stack.extend(subdirs)
+
+            for path in files:
+                known = self._fonts.get(path)
+                if unchanged and known is not None:
+                    fonts[path] = known
+                    continue
+                try:
+                    file_mtime = os.stat(path).st_mtime_ns
+                    if known is not None and known['mtime'] == file_mtime:
+                        fonts[path] = known
+                    else:
+                        fonts[path] = {'mtime': file_mtime, 'faces': read_font_names(path)}
+                except (OSError, struct.error):
+                    # Unreadable or malformed font; leave it out
+                    continue
+
+        changed = dirs != self._dirs or fonts != self._fonts
+        self._dirs, self._fonts = dirs, fonts
+        self._build_lookup()
+        return changed
+
+    def _build_lookup(self):
+        self._lookup = {}
+        for path in sorted(self._fonts):
+            for face, (family, style, postscript) in enumerate(self._fonts[path]['faces']):
+                if family:
+                    self._lookup.setdefault((family.lower(), style.lower()), (path, face))
+
+    def paths(self):
+        """Every indexed font file"""
+        return sorted(self._fonts)
+
+    def families(self):
+        """Installed families mapped to their sorted style names"""
+        families = {}
+        for family, style in {(family, style) for family, style, postscript in self.faces()}:
+            families.setdefault(family, set()).add(style)
+        return {family: sorted(styles, key=style_sort_key)
+                for family, styles in sorted(families.items())}
+
+    def faces(self):
+        """(family, style, PostScript name) for every indexed face with a family name"""
+        return [tuple(face) for entry in self._fonts.values()
+                for face in entry['faces'] if face[0]]
+
+    def find(self, family, style):
+        """(path, face index) for a family/style, or None if not installed"""
+        return self._lookup.get((family.lower(), style.lower()))
+
+_system_index = None
+
+def system_font_index():
+    """The installed-font index, loaded from disk and refreshed once per process"""
+    global _system_index
+    if _system_index is None:
+        index = FontIndex().load()
+        if index.refresh():
+            try:
+                index.save()
+            except OSError:
+                pass  # a read-only cache folder only costs the next launch a rescan
+        _system_index = index
+    return _system_index
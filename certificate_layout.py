@@ -0,0 +1,115 @@
+"""Save and load projects so a batch can be rerun without marking text areas again
+
+A project file is JSON. Version 2 records the template (its path relative to
+the project file and its SHA-256, so a replaced image is noticed), the roster
+it was set up with, every text area's rect, column and style, and the font
+settings areas share. Version 1 layout files (areas and font only) still load.
+"""
+import os, json
+from dataclasses import dataclass
+
+from certificate_manifest import file_sha256
+
+LAYOUT_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+
+# Font settings a text area can override
+STYLE_KEYS = ('family', 'style', 'size', 'alignment', 'color', 'fit')
+
+@dataclass
+class Project:
+    """The contents of a project file; paths are absolute, None if not recorded"""
+    text_areas: list
+    font_settings: dict
+    template_path: str = None
+    template_sha256: str = None
+    data_path: str = None
+
+    def template_changed(self):
+        """True if the template file differs from the one the project was saved with"""
+        if self.template_path is None or self.template_sha256 is None:
+            return False
+        return file_sha256(self.template_path) != self.template_sha256
+
+def _relative(path, base_dir):
+    """path relative to base_dir with / separators, or absolute on another drive"""
+    try:
+        path = os.path.relpath(os.path.abspath(path), base_dir)
+    except ValueError:
+        path = os.path.abspath(path)
+    return path.replace(os.sep, "/")
+
+def _resolve(path, base_dir):
+    return os.path.normpath(os.path.join(base_dir, path))
+
+def _rect(rect):
+    """Whole-pixel rect, rounded the way Layout.from_settings rounds the editor's drags"""
+    return [int(round(v)) for v in rect]
+
+def _style(settings):
+    style = {key: settings[key] for key in STYLE_KEYS if key in settings}
+    if 'color' in style:
+        style['color'] = tuple(style['color'])
+    return style
+
+def save_layout(path, text_areas, font_settings, template_path=None, data_path=None):
+    """Write text areas and font settings to a JSON project file
+
+    template_path and data_path, if given, are recorded relative to the
+    project file so the folder can be moved as a whole.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    layout = {'version': LAYOUT_VERSION}
+    if template_path:
+        layout['template'] = {'path': _relative(template_path, base_dir),
+                              'sha256': file_sha256(template_path)}
+    if data_path:
+        layout['data'] = {'path': _relative(data_path, base_dir)}
+
+    areas = []
+    for area in text_areas:
+        saved = {'rect': _rect(area['rect']), 'column': area['column']}
+        if area.get('style'):
+            saved['style'] = {key: list(value) if key == 'color' else value
+                              for key, value in _style(area['style']).items()}
+        areas.append(saved)
+    layout['text_areas'] = areas
+    layout['font'] = {
+        'family': font_settings['family'],
+        'style': font_settings['style'],
+        'size': font_settings['size'],
+        'alignment': font_settings['alignment'],
+        'color': list(font_settings['color']),
+        'fit': bool(font_settings.get('fit', False)),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(layout, f, indent=2)
+
+def load_project(path):
+    """Read a JSON project (or version 1 layout) file"""
+    with open(path, encoding="utf-8") as f:
+        layout = json.load(f)
+
+    if layout.get('version') not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported layout version: {layout.get('version')}")
+
+    text_areas = []
+    for area in layout['text_areas']:
+        loaded = {'rect': tuple(_rect(area['rect'])), 'column': area['column']}
+        if area.get('style'):
+            loaded['style'] = _style(area['style'])
+        text_areas.append(loaded)
+    font_settings = _style(layout['font'])
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    template = layout.get('template') or {}
+    data = layout.get('data') or {}
+    return Project(text_areas, font_settings,
+                   template_path=_resolve(template['path'], base_dir) if 'path' in template else None,
+                   template_sha256=template.get('sha256'),
+                   data_path=_resolve(data['path'], base_dir) if 'path' in data else None)
+
+def load_layout(path):
+    """Read a JSON project or layout file, returning (text_areas, font_settings)"""
+    project = load_project(path)
+    return project.text_areas, project.font_settings
@@ -0,0 +1,144 @@
+"""Checkpoint manifest for batch runs, so an interrupted run can be resumed.
+
+manifest.jsonl in the output folder holds one JSON record per row as it
+finishes: the row key (its file name), a hash of everything that went into
+rendering it, the files written with their size, mtime and SHA-256, and
+whether the row succeeded. Later records for a key
+replace earlier ones, so the file can simply be appended to while a run is in
+progress and is compacted to one line per key when the run ends. A record
+from the same inputs keeps the files an earlier one listed, so a combined PDF
+run (which writes no per-row file) does not forget the row's per-row PDF.
+"""
+import os, json, hashlib
+
+MANIFEST_NAME = "manifest.jsonl"
+
+def file_entry(output_dir, name, data=None):
+    """Manifest entry for a written file; data, if given, is its content (saves reading it back)"""
+    path = os.path.join(output_dir, name)
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    stat = os.stat(path)
+    return {'file': name, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'sha256': hashlib.sha256(data).hexdigest()}
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def check_entry(output_dir, entry, deep=False):
+    """Problem with a recorded output file, or None if it is intact
+
+    The quick check compares size and mtime; deep also re-hashes the content.
+    """
+    path = os.path.join(output_dir, entry['file'])
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "missing"
+    if stat.st_size != entry['size']:
+        return "size changed"
+    if deep:
+        if file_sha256(path) != entry['sha256']:
+            return "content changed"
+    elif stat.st_mtime_ns != entry['mtime']:
+        return "modified"
+    return None
+
+class Manifest:
+    """Per-row records of a batch run in output_dir"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.records = {}
+        self._file = None
+
+    def load(self):
+        """Read the records of earlier runs; a torn last line from a crash is ignored"""
+        self.records = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.records[record['key']] = record
+        except OSError:
+            pass
+        return self
+
+    def is_complete(self, key, formats, input_hash=None, deep=False):
+        """True if the row finished from the same inputs and every output in formats is still intact"""
+        record = self.records.get(key)
+        if record is None or record.get('status') != "done":
+            return False
+        if input_hash is not None and record.get('input') != input_hash:
+            return False
+        outputs = record.get('outputs', {})
+        return all(fmt in outputs and check_entry(self.output_dir, outputs[fmt], deep) is None
+                   for fmt in formats)
+
+    def open(self, fresh=False):
+        """Start appending records; fresh discards those of earlier runs"""
+        if fresh:
+            self.records = {}
+        self._file = open(self.path, "w" if fresh else "a", encoding="utf-8")
+        return self
+
+    def add(self, record):
+        """Record a finished row, flushed at once so a crash loses at most this line"""
+        earlier = self.records.get(record['key'])
+        if earlier is not None and earlier.get('input') == record.get('input'):
+            record = dict(record, outputs={**earlier.get('outputs', {}), **record['outputs']})
+        self.records[record['key']] = record
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        """Stop appending and rewrite the manifest with one record per key"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def prune(self, keep, records=None):
+        """Delete the outputs of every row whose key is not in keep; returns the removed keys
+
+        records defaults to this manifest's; pass earlier records to prune rows
+        a fresh run has already forgotten.
+        """
+        records = self.records if records is None else records
+        removed = [key for key in records if key not in keep]
+        for key in removed:
+            outputs = records[key].get('outputs', {})
+            self.records.pop(key, None)
+            for entry in outputs.values():
+                try:
+                    os.remove(os.path.join(self.output_dir, entry['file']))
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def verify(self, deep=True):
+        """(key, problem) for every row that failed or whose outputs are damaged or missing"""
+        problems = []
+        for key, record in self.records.items():
+            if record.get('status') != "done":
+                problems.append((key, record.get('error') or "failed"))
+                continue
+            for fmt, entry in record.get('outputs', {}).items():
+                problem = check_entry(self.output_dir, entry, deep)
+                if problem:
+                    problems.append((key, f"{entry['file']}: {problem}"))
+        return problems
@@ -0,0 +1,524 @@
+"""Streaming PDF output for whole rosters.
+
+Pages are written to disk as soon as they are added; the writer only keeps the
+byte offset of each object, so memory stays flat however many pages a file
+has. Page images are embedded as JPEG (DCTDecode), like Pillow's PDF writer.
+
+VectorPdfWriter and OverlayPdfWriter embed the template image once per file
+and share it between every page. When the template was loaded from a JPEG its
+original bytes are used as-is, so the template is never re-encoded. The vector
+backend draws the recipient text as real PDF text in an embedded subset of the
+layout's font (needs fontTools); the overlay backend adds each row's text as a
+small losslessly compressed image masked onto the template.
+"""
+import io, os, zlib, hashlib, logging, threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from certificate_render import text_sprites
+
+def _pdf_number(value):
+    """Format a number the way PDF expects (no exponent, trimmed zeros)"""
+    text = f"{value:.4f}".rstrip("0").rstrip(".")
+    return text if text not in ("", "-0") else "0"
+
+class PdfWriter:
+    """Low-level PDF file writer: numbered objects, a page tree and the xref table"""
+
+    # Written in the header; subclasses raise it before calling __init__ if they need to
+    version = b"1.4"
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._offsets = {}
+        self._next_id = 1
+        self._page_ids = []
+        self._file.write(b"%%PDF-%s\n%%\xe2\xe3\xcf\xd3\n" % self.version)
+        self.catalog_id = self.reserve()
+        self.pages_id = self.reserve()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    def reserve(self):
+        """Allocate an object number to be written later"""
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def write_object(self, obj_id, body, stream=None):
+        """Write object obj_id; body is the dictionary (or other value) as bytes"""
+        self._offsets[obj_id] = self._file.tell()
+        self._file.write(b"%d 0 obj\n" % obj_id)
+        if stream is None:
+            self._file.write(body)
+        else:
+            # Stream objects take a dictionary; append the stream length to it
+            self._file.write(body[:-2].rstrip() + b" /Length %d >>\nstream\n" % len(stream))
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def add_object(self, body, stream=None):
+        """Write a new object and return its number"""
+        obj_id = self.reserve()
+        self.write_object(obj_id, body, stream)
+        return obj_id
+
+    def add_page(self, width, height, content, resources):
+        """Write a page of width x height points with a content stream and resources dict"""
+        content_id = self.add_object(b"<< >>", content)
+        page_id = self.add_object(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Contents %d 0 R /Resources %s >>"
+            % (self.pages_id, _pdf_number(width).encode(), _pdf_number(height).encode(),
+               content_id, resources))
+        self._page_ids.append(page_id)
+        return page_id
+
+    def close(self):
+        """Write the page tree, catalog, xref table and trailer"""
+        if self._file.closed:
+            return
+        try:
+            kids = b" ".join(b"%d 0 R" % page_id for page_id in self._page_ids)
+            self.write_object(self.pages_id, b"<< /Type /Pages /Kids [%s] /Count %d >>"
+                              % (kids, len(self._page_ids)))
+            self.write_object(self.catalog_id, b"<< /Type /Catalog /Pages %d 0 R >>" % self.pages_id)
+
+            xref_offset = self._file.tell()
+            self._file.write(b"xref\n0 %d\n0000000000 65535 f \n" % self._next_id)
+            for obj_id in range(1, self._next_id):
+                self._file.write(b"%010d 00000 n \n" % self._offsets.get(obj_id, 0))
+            self._file.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                             % (self._next_id, self.catalog_id, xref_offset))
+        finally:
+            self._file.close()
+
+def encode_jpeg(img, quality=100):
+    """JPEG-encode a page image, returning (bytes, size, mode)"""
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue(), img.size, img.mode
+
+def source_jpeg(path, template):
+    """(bytes, size, mode) of the JPEG file at path, if it decodes to the same size as template
+
+    Returns None for anything that can't be embedded untouched: other formats,
+    CMYK JPEGs or a file that no longer matches the loaded template.
+    """
+    try:
+        with Image.open(path) as img:
+            if img.format != "JPEG" or img.mode not in ("RGB", "L") or img.size != template.size:
+                return None
+            mode = img.mode
+        with open(path, "rb") as f:
+            return f.read(), template.size, mode
+    except OSError:
+        return None
+
+def layout_template_jpeg(layout, quality=100):
+    """The layout's template as JPEG, passing the source file through when possible"""
+    if layout.template_path:
+        found = source_jpeg(layout.template_path, layout.template)
+        if found:
+            return found
+    return encode_jpeg(layout.template, quality)
+
+class StreamingPdfWriter(PdfWriter):
+    """Multi-page PDF where each page is one full-page JPEG image"""
+
+    def __init__(self, path, resolution=300.0, quality=100):
+        super().__init__(path)
+        self.resolution = resolution
+        self.quality = quality
+
+    def add_image(self, img):
+        """Encode and append a rendered certificate as a new page"""
+        self.add_jpeg(*encode_jpeg(img, self.quality))
+
+    def add_jpeg(self, data, size, mode="RGB"):
+        """Append a page from already-encoded JPEG bytes"""
+        colorspace = b"/DeviceGray" if mode == "L" else b"/DeviceRGB"
+        image_id = self.add_object(
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+            b"/BitsPerComponent 8 /Filter /DCTDecode >>" % (size[0], size[1], colorspace),
+            data)
+        width = size[0] * 72.0 / self.resolution
+        height = size[1] * 72.0 / self.resolution
+        content = b"q %s 0 0 %s 0 0 cm /image Do Q" % (_pdf_number(width).encode(),
+                                                        _pdf_number(height).encode())
+        self.add_page(width, height, content, b"<< /XObject << /image %d 0 R >> >>" % image_id)
+
+class ShardedPdfWriter:
+    """Splits a stream of pages over numbered PDF files of pages_per_file each
+
+    Files are named <base>_0001.pdf, <base>_0002.pdf, ... in output_dir.
+    """
+
+    def __init__(self, output_dir, base="certificates", pages_per_file=500,
+                 writer=StreamingPdfWriter, **writer_options):
+        self.output_dir = output_dir
+        self.base = base
+        self.pages_per_file = pages_per_file
+        self.paths = []
+        self._writer_class = writer
+        self._writer_options = writer_options
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _current(self):
+        if self._writer is None or self._writer.page_count >= self.pages_per_file:
+            self.close()
+            path = os.path.join(self.output_dir, f"{self.base}_{len(self.paths) + 1:04d}.pdf")
+            self._writer = self._writer_class(path, **self._writer_options)
+            self.paths.append(path)
+        return self._writer
+
+    def add_image(self, img):
+        self._current().add_image(img)
+
+    def add_jpeg(self, data, size, mode="RGB"):
+        self._current().add_jpeg(data, size, mode)
+
+    def add_texts(self, texts, placements=None):
+        self._current().add_texts(texts, placements)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+class TemplatePdfWriter(PdfWriter):
+    """PDF whose pages all draw one shared template image XObject"""
+
+    def __init__(self, path, template, resolution=300.0, quality=100, template_jpeg=None):
+        super().__init__(path)
+        self.resolution = resolution
+        self.scale = 72.0 / resolution
+        self.page_width = template.width * self.scale
+        self.page_height = template.height * self.scale
+
+        # Encoded once per file (or once per process when template_jpeg is passed in)
+        data, size, mode = template_jpeg or encode_jpeg(template, quality)
+        colorspace = b"/DeviceGray" if mode == "L" else b"/DeviceRGB"
+        self.template_id = self.add_object(
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+            b"/BitsPerComponent 8 /Filter /DCTDecode >>" % (size[0], size[1], colorspace),
+            data)
+
+    def template_content(self):
+        """Content stream operators that paint the template over the whole page"""
+        return b"q %s 0 0 %s 0 0 cm /template Do Q\n" % (_pdf_number(self.page_width).encode(),
+                                                          _pdf_number(self.page_height).encode())
+
+class _FontSource:
+    """A font file read and parsed once per process, shared by every file that embeds it
+
+    The parsed font is only read from (cmap, metrics); each subset is cut
+    from a fresh, lazily loaded copy of the file's bytes.
+    """
+
+    def __init__(self, path, face):
+        try:
+            from fontTools.ttLib import TTFont
+        except ImportError as e:
+            raise ImportError("Vector PDF output needs fontTools:\npip install fonttools") from e
+
+        with open(path, "rb") as f:
+            self.data = f.read()
+        self.face = face
+        font = self.font = TTFont(io.BytesIO(self.data), fontNumber=face)
+        self.cmap = font.getBestCmap() or {}
+        self.glyph_ids = font.getReverseGlyphMap()
+        # Load every table write() reads now, so sharing the font needs no locking
+        self.units = font['head'].unitsPerEm
+        self.hmtx, self.head, self.hhea = font['hmtx'], font['head'], font['hhea']
+        self.os2 = font['OS/2'] if 'OS/2' in font else None
+        self.is_cff = 'CFF ' in font
+        postscript = font['name'].getDebugName(6) or "Font"
+        self.postscript_name = "".join(c for c in postscript if c.isalnum() or c in "-_")
+
+    def subset(self, gids):
+        """The font program cut down to gids, glyph IDs unchanged"""
+        from fontTools import subset
+        from fontTools.ttLib import TTFont
+
+        options = subset.Options()
+        options.retain_gids = True
+        options.notdef_outline = True
+        options.layout_features = []
+        # Text is placed glyph by glyph, so substitution and positioning tables go
+        options.drop_tables += ['GSUB', 'GPOS', 'GDEF', 'FFTM']
+        font = TTFont(io.BytesIO(self.data), fontNumber=self.face)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(gids=gids)
+        subsetter.subset(font)
+        buffer = io.BytesIO()
+        font.save(buffer)
+        return buffer.getvalue()
+
+# Per process, so a per-row run parses each font once rather than once per file
+_font_sources = {}
+_font_sources_lock = threading.Lock()
+
+def _font_source(path, face):
+    with _font_sources_lock:
+        source = _font_sources.get((path, face))
+        if source is None:
+            # The subsetter logs every table it can't handle; the PDF doesn't need them
+            logging.getLogger("fontTools.subset").setLevel(logging.ERROR)
+            source = _font_sources[path, face] = _FontSource(path, face)
+        return source
+
+class _EmbeddedFont:
+    """A TrueType/OpenType font embedded as a CID-keyed subset of the glyphs used
+
+    Glyph IDs are used directly as character codes (Identity-H) and kept
+    stable by the subsetter, so pages can be written before the subset is.
+    """
+
+    def __init__(self, path, face=0):
+        self._source = _font_source(path, face)
+        self._used = {0: ""}
+        self.is_cff = self._source.is_cff
+        self.postscript_name = self._source.postscript_name
+
+    def encode(self, text):
+        """PDF hex string of glyph IDs for text, remembering which glyphs to embed"""
+        cmap, glyph_ids = self._source.cmap, self._source.glyph_ids
+        gids = []
+        for ch in text:
+            name = cmap.get(ord(ch))
+            gid = glyph_ids.get(name, 0) if name else 0
+            self._used.setdefault(gid, ch)
+            gids.append(gid)
+        return b"<" + "".join("%04X" % gid for gid in gids).encode() + b">"
+
+    def _scaled(self, value):
+        return int(round(value * 1000.0 / self._source.units))
+
+    def _to_unicode(self):
+        entries = [(gid, text) for gid, text in sorted(self._used.items()) if text]
+        lines = [b"/CIDInit /ProcSet findresource begin", b"12 dict begin", b"begincmap",
+                 b"/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+                 b"/CMapName /Adobe-Identity-UCS def", b"/CMapType 2 def",
+                 b"1 begincodespacerange", b"<0000> <FFFF>", b"endcodespacerange"]
+        for start in range(0, len(entries), 100):
+            block = entries[start:start + 100]
+            lines.append(b"%d beginbfchar" % len(block))
+            for gid, text in block:
+                lines.append(b"<%04X> <%s>" % (gid, text.encode("utf-16-be").hex().upper().encode()))
+            lines.append(b"endbfchar")
+        lines += [b"endcmap", b"CMapName currentdict /CMap defineresource pop", b"end", b"end"]
+        return b"\n".join(lines)
+
+    def write(self, writer, font_id):
+        """Write the font dictionaries and the subset program as font_id"""
+        source = self._source
+        glyph_order = source.font.getGlyphOrder()
+        widths = b" ".join(b"%d [%d]" % (gid, self._scaled(source.hmtx[glyph_order[gid]][0]))
+                           for gid in sorted(self._used))
+        head, hhea, os2 = source.head, source.hhea, source.os2
+        cap_height = getattr(os2, 'sCapHeight', 0) or hhea.ascent
+
+        # Subset fonts are named with a tag derived from the glyphs they contain
+        digest = hashlib.md5(repr(sorted(self._used)).encode()).digest()
+        tag = "".join(chr(ord("A") + b % 26) for b in digest[:6])
+        base_font = f"/{tag}+{self.postscript_name}".encode()
+
+        program = source.subset(sorted(self._used))
+        if self.is_cff:
+            file_id = writer.add_object(b"<< /Subtype /OpenType /Filter /FlateDecode >>",
+                                        zlib.compress(program))
+            file_key, subtype, gid_map = b"/FontFile3", b"/CIDFontType0", b""
+        else:
+            file_id = writer.add_object(b"<< /Length1 %d /Filter /FlateDecode >>" % len(program),
+                                        zlib.compress(program))
+            file_key, subtype, gid_map = b"/FontFile2", b"/CIDFontType2", b" /CIDToGIDMap /Identity"
+
+        descriptor_id = writer.add_object(
+            b"<< /Type /FontDescriptor /FontName %s /Flags 4 /FontBBox [%d %d %d %d] "
+            b"/ItalicAngle 0 /Ascent %d /Descent %d /CapHeight %d /StemV 80 %s %d 0 R >>"
+            % (base_font, self._scaled(head.xMin), self._scaled(head.yMin),
+               self._scaled(head.xMax), self._scaled(head.yMax), self._scaled(hhea.ascent),
+               self._scaled(hhea.descent), self._scaled(cap_height), file_key, file_id))
+        cid_font_id = writer.add_object(
+            b"<< /Type /Font /Subtype %s /BaseFont %s /CIDSystemInfo << /Registry (Adobe) "
+            b"/Ordering (Identity) /Supplement 0 >> /FontDescriptor %d 0 R /W [%s]%s >>"
+            % (subtype, base_font, descriptor_id, widths, gid_map))
+        to_unicode_id = writer.add_object(b"<< >>", self._to_unicode())
+        writer.write_object(font_id, b"<< /Type /Font /Subtype /Type0 /BaseFont %s "
+                                     b"/Encoding /Identity-H /DescendantFonts [%d 0 R] "
+                                     b"/ToUnicode %d 0 R >>"
+                                     % (base_font, cid_font_id, to_unicode_id))
+
+class _StandardFont:
+    """Helvetica, for layouts using Pillow's built-in font, which has no font file to embed"""
+
+    def encode(self, text):
+        raw = text.encode("cp1252", "replace")
+        return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+    def write(self, writer, font_id):
+        writer.write_object(font_id, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+                                     b"/Encoding /WinAnsiEncoding >>")
+
+class VectorPdfWriter(TemplatePdfWriter):
+    """Multi-page PDF of a shared template image with real, searchable text
+
+    Text is placed with the same alignment math as the raster renderer and
+    drawn in an embedded subset of each area's font, written when the file
+    is closed.
+    """
+
+    def __init__(self, path, layout, resolution=300.0, quality=100, template_jpeg=None):
+        # One PDF font per font file the areas use, as /F1, /F2, ...
+        text_fonts = {}
+        for area in layout.plan:
+            key = (area.style.font_path, area.style.font_face)
+            if key not in text_fonts:
+                text_fonts[key] = (_StandardFont() if key[0] is None
+                                   else _EmbeddedFont(area.style.font_path, area.style.font_face))
+        if any(getattr(text_font, 'is_cff', False) for text_font in text_fonts.values()):
+            # Embedding an OpenType (CFF) font program is a PDF 1.6 feature
+            self.version = b"1.6"
+
+        super().__init__(path, layout.template, resolution, quality,
+                         template_jpeg or layout_template_jpeg(layout, quality))
+        self.layout = layout
+        self._fonts = {key: (b"/F%d" % (i + 1), self.reserve(), text_font)
+                       for i, (key, text_font) in enumerate(text_fonts.items())}
+        self._areas = []
+        for area in layout.plan:
+            name, font_id, text_font = self._fonts[(area.style.font_path, area.style.font_face)]
+            color = b" ".join(_pdf_number(c / 255.0).encode() for c in area.style.color[:3])
+            self._areas.append((area, name, text_font, b"%s rg" % color))
+
+        fonts = b" ".join(b"%s %d 0 R" % (name, font_id)
+                          for name, font_id, text_font in self._fonts.values())
+        self._resources = (b"<< /XObject << /template %d 0 R >> /Font << %s >> >>"
+                           % (self.template_id, fonts))
+
+    def add_texts(self, texts, placements=None):
+        """Append a page with one text per layout area
+
+        placements, from measure_rows, saves measuring the texts again.
+        """
+        content = [self.template_content(), b"BT"]
+        current = (None, None)
+        for i, ((area, name, text_font, color), text) in enumerate(zip(self._areas, texts)):
+            if not text:
+                continue
+            # Auto-fit areas may draw each text at its own size
+            pil_font, _, (tx, ty) = placements[i] if placements else area.place(text)
+            size = getattr(pil_font, 'size', area.style.size) if area.style.fit else area.style.size
+            font = b"%s %s Tf" % (name, _pdf_number(size * self.scale).encode())
+            # Font and colour are set again only where they change
+            if font != current[0]:
+                content.append(font)
+            if color != current[1]:
+                content.append(color)
+            current = (font, color)
+            # Placement uses Pillow's metrics for the same font and pixel size
+            ascent = pil_font.getmetrics()[0] if hasattr(pil_font, 'getmetrics') else 0
+            x = tx * self.scale
+            y = self.page_height - (ty + ascent) * self.scale
+            content.append(b"1 0 0 1 %s %s Tm %s Tj" % (_pdf_number(x).encode(),
+                                                         _pdf_number(y).encode(),
+                                                         text_font.encode(text)))
+        content.append(b"ET")
+        self.add_page(self.page_width, self.page_height, b"\n".join(content), self._resources)
+
+    def close(self):
+        if not self._file.closed:
+            try:
+                for name, font_id, text_font in self._fonts.values():
+                    text_font.write(self, font_id)
+            except BaseException:
+                self._file.close()
+                raise
+        super().close()
+
+class OverlayPdfWriter(TemplatePdfWriter):
+    """Multi-page PDF of the shared template with each row's text as a masked image
+
+    Text is rasterized exactly as the raster renderer draws it, so pages match
+    the raster backend, but per row only the text's alpha mask is compressed
+    (Flate, lossless) instead of JPEG-encoding the whole page again. The mask
+    is applied as the soft mask of a one-pixel image in the text colour.
+    Text that repeats within a file in the same font, size and colour reuses
+    its image.
+    """
+
+    # Masked images kept for reuse within one file
+    MAX_REUSED = 1024
+
+    def __init__(self, path, layout, resolution=300.0, quality=100, template_jpeg=None,
+                 sprites=None):
+        super().__init__(path, layout.template, resolution, quality,
+                         template_jpeg or layout_template_jpeg(layout, quality))
+        self.layout = layout
+        self.sprites = sprites or text_sprites
+        self._images = OrderedDict()
+
+    def _text_image(self, area, font, text, mask):
+        """Object number of the masked image for text in an area, writing it on first use"""
+        key = (font, area.style.color, text)
+        image_id = self._images.get(key)
+        if image_id is not None:
+            self._images.move_to_end(key)
+            return image_id
+
+        mask_id = self.add_object(
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray "
+            b"/BitsPerComponent 8 /Filter /FlateDecode >>" % mask.size,
+            zlib.compress(mask.tobytes()))
+        image_id = self.add_object(
+            b"<< /Type /XObject /Subtype /Image /Width 1 /Height 1 /ColorSpace /DeviceRGB "
+            b"/BitsPerComponent 8 /SMask %d 0 R >>" % mask_id, bytes(area.style.color[:3]))
+
+        self._images[key] = image_id
+        if len(self._images) > self.MAX_REUSED:
+            self._images.popitem(last=False)
+        return image_id
+
+    def add_texts(self, texts, placements=None):
+        """Append a page with one text per layout area
+
+        placements, from measure_rows, saves measuring the texts again.
+        """
+        content = [self.template_content()]
+        names = []
+        for i, (area, text) in enumerate(zip(self.layout.plan, texts)):
+            font, bbox, (tx, ty) = placements[i] if placements else area.place(text)
+            mask = self.sprites.get(font, text)[0]
+            if mask is None:
+                continue
+            image_id = self._text_image(area, font, text, mask)
+            x = (tx + bbox[0]) * self.scale
+            y = self.page_height - (ty + bbox[3]) * self.scale
+            content.append(b"q %s 0 0 %s %s %s cm /t%d Do Q"
+                           % (_pdf_number(mask.width * self.scale).encode(),
+                              _pdf_number(mask.height * self.scale).encode(),
+                              _pdf_number(x).encode(), _pdf_number(y).encode(), image_id))
+            names.append(b"/t%d %d 0 R" % (image_id, image_id))
+
+        resources = b"<< /XObject << /template %d 0 R %s >> >>" % (self.template_id,
+                                                                    b" ".join(names))
+        self.add_page(self.page_width, self.page_height, b"\n".join(content), resources)
@@ -0,0 +1,563 @@
+"""Rendering helpers shared by the editor and the batch generator.
+
+Nothing in here imports tkinter, so worker processes can load it cheaply.
+"""
+import hashlib, threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from functools import cached_property
+
+from PIL import Image, ImageDraw
+
+from certificate_fonts import font_registry
+
+@dataclass(frozen=True)
+class TextStyle:
+    """Font, size, alignment and colour of an area's text
+
+    With fit, size is the largest size used: text too big for its area at
+    that size is drawn at the largest size that fits.
+    """
+    family: str = "Times New Roman"
+    style: str = "Regular"
+    size: int = 50
+    alignment: str = "center"
+    color: tuple = (0, 0, 0)
+    # Font file resolved by the caller, so worker processes skip the lookup
+    font_path: object = None
+    font_face: int = 0
+    fit: bool = False
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Style from editor-style font settings, resolving the font file"""
+        resolution = font_registry.resolve(settings['family'], settings['style'])
+        return cls(family=settings['family'], style=settings['style'], size=settings['size'],
+                   alignment=settings['alignment'], color=tuple(settings['color']),
+                   font_path=resolution.path, font_face=resolution.face,
+                   fit=bool(settings.get('fit', False)))
+
+    def scaled(self, scale):
+        return replace(self, size=max(1, int(round(self.size * scale))))
+
+    @property
+    def font(self):
+        return self.font_at(self.size)
+
+    def font_at(self, size):
+        """This style's font at another size"""
+        if self.font_path is None:
+            return font_registry.get(self.family, self.style, size)
+        return font_registry.load(self.font_path, size, self.font_face)
+
+# Auto-fit never shrinks text below this size
+MIN_FIT_SIZE = 6
+
+class FitSizeCache:
+    """Largest font size at which a text fits an area, for auto-fit styles
+
+    Sizes are searched between MIN_FIT_SIZE and the style's size. Glyph
+    widths scale almost linearly with size, so the bbox at full size gives an
+    estimate that is usually right or one off; the estimate and its
+    neighbour are checked first and a binary search covers the rest. Results
+    are cached per (font, size, area size, text). Safe to share between
+    threads.
+    """
+
+    def __init__(self, max_entries=65536):
+        self.max_entries = max_entries
+        self.measurements = 0
+        self._sizes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def size(self, style, text, width, height):
+        key = (style.font_path, style.font_face, style.family, style.style, style.size,
+               width, height, text)
+        with self._lock:
+            size = self._sizes.get(key)
+            if size is not None:
+                self._sizes.move_to_end(key)
+                return size
+
+        def measure(size):
+            self.measurements += 1
+            bbox = text_metrics.bbox(style.font_at(size), text)
+            return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+        def fits(size):
+            w, h = measure(size)
+            return w <= width and h <= height
+
+        low, high = min(MIN_FIT_SIZE, style.size), style.size
+        w, h = measure(high) if text else (0, 0)
+        if w <= width and h <= height:
+            low = high
+        else:
+            high -= 1
+            scale = min(width / w if w else 1, height / h if h else 1)
+            guess = max(low, min(high, int(style.size * scale)))
+            if fits(guess):
+                low = guess
+                if guess < high:
+                    if fits(guess + 1):
+                        low = guess + 1
+                    else:
+                        high = guess
+            else:
+                high = guess - 1
+                if high > low:
+                    if fits(high):
+                        low = high
+                    else:
+                        high -= 1
+            # Largest size in [low, high] that fits; low if none does
+            while low < high:
+                middle = (low + high + 1) // 2
+                if fits(middle):
+                    low = middle
+                else:
+                    high = middle - 1
+
+        with self._lock:
+            self._sizes[key] = low
+            if len(self._sizes) > self.max_entries:
+                self._sizes.popitem(last=False)
+        return low
+
+    def clear(self):
+        with self._lock:
+            self._sizes.clear()
+
+# Shared by every layout in the process
+fit_sizes = FitSizeCache()
+
+@dataclass(frozen=True)
+class TextArea:
+    """A rectangle on the template and the data column drawn into it
+
+    style is None when the area uses the layout's own font settings.
+    """
+    rect: tuple
+    column: str
+    style: object = None
+
+@dataclass(frozen=True, eq=False)
+class AreaPlan:
+    """A text area compiled for rendering: font loaded and alignment anchor fixed"""
+    rect: tuple
+    style: TextStyle
+    font: object
+    anchor: tuple
+
+    @classmethod
+    def compile(cls, rect, style, font):
+        if style.alignment == "center":
+            x = (rect[0] + rect[2]) // 2
+        elif style.alignment == "left":
+            x = rect[0]
+        else:  # right
+            x = rect[2]
+        return cls(rect, style, font, (x, (rect[1] + rect[3]) // 2))
+
+    def font_for(self, text):
+        """Font to draw text in: the style's, or for auto-fit the size that fits the rect"""
+        style = self.style
+        if not style.fit:
+            return self.font
+        size = fit_sizes.size(style, text, self.rect[2] - self.rect[0], self.rect[3] - self.rect[1])
+        return self.font if size == style.size else style.font_at(size)
+
+    def origin(self, bbox):
+        """Draw origin for text with this bbox; the same result as align_text"""
+        x, y = self.anchor
+        if self.style.alignment == "center":
+            x -= (bbox[2] - bbox[0]) // 2
+        elif self.style.alignment != "left":
+            x -= bbox[2] - bbox[0]
+        return x, y - (bbox[3] - bbox[1]) // 2
+
+    def place(self, text):
+        """(font, bbox, origin) of text in this area, measured through text_metrics"""
+        font = self.font_for(text)
+        bbox = text_metrics.bbox(font, text)
+        return font, bbox, self.origin(bbox)
+
+def measure_rows(plan, rows):
+    """Place the texts of many rows before any is drawn, measuring each distinct text once
+
+    rows are tuples of area texts, as build_rows makes them. Returns one
+    tuple of placements per row, as AreaPlan.place gives them, to pass to
+    IncrementalRenderer.render or a PDF writer's add_texts. A row with a
+    text that can't be measured gets None, so drawing it measures it again
+    and the error is raised for that row alone.
+    """
+    known = [{} for _ in plan]
+    placed = []
+    for texts in rows:
+        try:
+            row = []
+            for area, seen, text in zip(plan, known, texts):
+                placement = seen.get(text)
+                if placement is None:
+                    placement = seen[text] = area.place(text)
+                row.append(placement)
+            placed.append(tuple(row))
+        except Exception:
+            placed.append(None)
+    return placed
+
+@dataclass(frozen=True, eq=False)
+class Layout:
+    """Everything needed to render a certificate except the row itself
+
+    style is the default for areas without a style of their own.
+    """
+    template: object
+    areas: tuple
+    style: TextStyle = TextStyle()
+    # File the template was loaded from, so PDF output can embed its bytes as-is
+    template_path: object = None
+
+    @classmethod
+    def from_settings(cls, template, text_areas, font_settings, template_path=None):
+        """Build a layout from editor-style text area dicts and font settings
+
+        An area dict's optional 'style' holds the settings it overrides.
+        """
+        default = TextStyle.from_settings(font_settings)
+        areas = []
+        for area in text_areas:
+            style = None
+            if area.get('style'):
+                settings = dict(font_settings, **area['style'])
+                style = TextStyle.from_settings(settings)
+                if style == default:
+                    style = None
+            # Dragging in the editor can leave fractional rects; pixels are whole
+            areas.append(TextArea(tuple(int(round(v)) for v in area['rect']), area['column'],
+                                  style))
+        return cls(template=template, areas=tuple(areas), style=default,
+                   template_path=template_path)
+
+    def scaled(self, scale, template):
+        """The same layout at another resolution, e.g. for an on-screen preview
+
+        template must already be resized by scale. Rects and font sizes are
+        scaled with it, so the alignment math is the same as the full-size render.
+        """
+        return replace(
+            self,
+            template=template,
+            template_path=None,
+            areas=tuple(TextArea(tuple(int(round(v * scale)) for v in area.rect), area.column,
+                                 area.style.scaled(scale) if area.style else None)
+                        for area in self.areas),
+            style=self.style.scaled(scale),
+        )
+
+    def fingerprint(self):
+        """Hash of everything in the layout that affects the rendered output
+
+        Covers the template pixels, area rects, font and colour settings, but
+        not which columns feed the areas; the row texts themselves are hashed
+        separately.
+        """
+        default = self.style
+        settings = (self.template.mode, self.template.size,
+                    tuple(area.rect for area in self.areas), default.family, default.style,
+                    default.size, default.alignment, tuple(default.color), default.font_path,
+                    default.font_face)
+        if default.fit:
+            settings += ("fit",)
+        styles = tuple(area.style for area in self.areas)
+        if any(styles):
+            settings += (styles,)
+        digest = hashlib.sha256(repr(settings).encode())
+        digest.update(self.template.tobytes())
+        return digest.hexdigest()
+
+    @cached_property
+    def plan(self):
+        """One AreaPlan per area, compiled on first use
+
+        Fonts are loaded and alignment anchors worked out once per layout, so
+        rendering a row only measures and pastes its texts.
+        """
+        default = self.style
+        fonts = {}
+        plan = []
+        for area in self.areas:
+            style = area.style or default
+            if style not in fonts:
+                fonts[style] = style.font
+            plan.append(AreaPlan.compile(area.rect, style, fonts[style]))
+        return tuple(plan)
+
+    def __getstate__(self):
+        # Loaded fonts stay in the process that compiled them
+        state = dict(self.__dict__)
+        state.pop('plan', None)
+        return state
+
+def area_texts(layout, record, overrides=None):
+    """Text for each area from a record (any mapping of column to value)
+
+    overrides maps area index to replacement text.
+    """
+    overrides = overrides or {}
+    return tuple(overrides[i] if i in overrides else str(record[area.column])
+                 for i, area in enumerate(layout.areas))
+
+def render(layout, record, overrides=None, show_guides=False):
+    """Render one certificate for a record into a new image
+
+    Reads nothing but its arguments, so it is safe to call from many threads
+    or processes at once.
+    """
+    return render_texts(layout, area_texts(layout, record, overrides), show_guides)
+
+def render_texts(layout, texts, show_guides=False):
+    """Render one certificate from the already-extracted text of each area"""
+    img = layout.template.copy()
+    boxes = draw_text_areas(img, layout.plan, texts)
+
+    if show_guides:
+        draw = ImageDraw.Draw(img)
+        for area, (tx, ty, tw, th) in zip(layout.areas, boxes):
+            # Text boundary
+            draw.rectangle([tx, ty, tx + tw, ty + th], outline="red", width=2)
+            # Rectangle area
+            draw.rectangle(list(area.rect), outline="blue", width=1)
+
+    return img
+
+def align_text(rect, bbox, alignment):
+    """Origin that aligns text with the given bbox inside rect"""
+    # Get text dimensions
+    tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+    # Calculate position based on alignment
+    if alignment == "center":
+        tx = (rect[0] + rect[2]) // 2 - tw // 2
+    elif alignment == "left":
+        tx = rect[0]
+    else:  # right
+        tx = rect[2] - tw
+
+    ty = (rect[1] + rect[3]) // 2 - th // 2
+    return tx, ty
+
+def _font_key(font):
+    """Hashable identity of a loaded font"""
+    path = getattr(font, 'path', None)
+    if not isinstance(path, str):
+        # In-memory fonts (e.g. Pillow's default) stay alive in the font cache
+        path = id(font)
+    return (path, getattr(font, 'index', 0), getattr(font, 'size', None))
+
+class TextMetrics:
+    """Cache of text bboxes, so each string is measured once per font
+
+    Keyed like TextSpriteCache (font file, face, size and text) but holding
+    only the bbox, so many more entries fit: a roster's names stay measured
+    while their sprites come and go. Safe to share between threads.
+    """
+
+    def __init__(self, max_entries=262144):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._bboxes = OrderedDict()
+        self._lock = threading.Lock()
+        self._measure = ImageDraw.Draw(Image.new("L", (1, 1)))
+
+    def bbox(self, font, text):
+        """bbox of text drawn at (0, 0) in font, as ImageDraw.textbbox gives it"""
+        key = _font_key(font) + (text,)
+        with self._lock:
+            bbox = self._bboxes.get(key)
+            if bbox is not None:
+                self._bboxes.move_to_end(key)
+                self.hits += 1
+                return bbox
+            self.misses += 1
+
+        bbox = self._measure.textbbox((0, 0), text, font=font)
+        with self._lock:
+            self._bboxes[key] = bbox
+            if len(self._bboxes) > self.max_entries:
+                self._bboxes.popitem(last=False)
+        return bbox
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._bboxes)}
+
+    def clear(self):
+        with self._lock:
+            self._bboxes.clear()
+
+# Shared by every renderer, writer and the editor in the process
+text_metrics = TextMetrics()
+
+class TextSpriteCache:
+    """LRU cache of rendered text, so repeated strings become a paste
+
+    Each entry is an alpha mask of the text plus its bbox relative to the draw
+    origin, keyed by font file, face, size and text. Masks carry no colour, so
+    one entry serves every text colour. Entries are evicted oldest-first once
+    either limit is exceeded. Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=4096):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._sprites = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, font, text):
+        """Return (mask, bbox) for text in font; mask is None for blank text"""
+        key = _font_key(font) + (text,)
+        with self._lock:
+            sprite = self._sprites.get(key)
+            if sprite is not None:
+                self._sprites.move_to_end(key)
+                self.hits += 1
+                return sprite
+            self.misses += 1
+
+        sprite = self._rasterize(font, text)
+        size = sprite[0].width * sprite[0].height if sprite[0] else 0
+
+        with self._lock:
+            if key not in self._sprites:
+                self._sprites[key] = sprite
+                self._bytes += size
+                while self._sprites and (self._bytes > self.max_bytes
+                                         or len(self._sprites) > self.max_entries):
+                    old_mask, old_bbox = self._sprites.popitem(last=False)[1]
+                    self._bytes -= old_mask.width * old_mask.height if old_mask else 0
+        return sprite
+
+    def _rasterize(self, font, text):
+        bbox = text_metrics.bbox(font, text)
+        width, height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        if width <= 0 or height <= 0:
+            return None, bbox
+
+        mask = Image.new("L", (width, height))
+        ImageDraw.Draw(mask).text((-bbox[0], -bbox[1]), text, font=font, fill=255)
+        return mask, bbox
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._sprites), 'bytes': self._bytes}
+
+    def clear(self):
+        with self._lock:
+            self._sprites.clear()
+            self._bytes = 0
+
+# Shared by every renderer in the process unless one is passed in
+text_sprites = TextSpriteCache()
+
+def paste_text(img, origin, sprite, text_color):
+    """Composite a cached text sprite onto img at a draw origin"""
+    mask, bbox = sprite
+    if mask is not None:
+        img.paste(text_color, (origin[0] + bbox[0], origin[1] + bbox[1]), mask)
+
+def sprite_image(sprite, text_color):
+    """A cached text sprite as a standalone RGBA image, or None for blank text"""
+    mask, bbox = sprite
+    if mask is None:
+        return None
+    img = Image.new("RGBA", mask.size, tuple(text_color)[:3] + (0,))
+    img.putalpha(mask)
+    return img
+
+def draw_text_areas(img, plan, texts, sprites=None):
+    """Draw one text per planned area onto img, aligned inside the area's rect
+
+    Returns the (x, y, width, height) box of every drawn text, in area order.
+    """
+    sprites = sprites or text_sprites
+    boxes = []
+
+    for area, text in zip(plan, texts):
+        sprite = sprites.get(area.font_for(text), text)
+        bbox = sprite[1]
+        tx, ty = area.origin(bbox)
+        paste_text(img, (tx, ty), sprite, area.style.color)
+        boxes.append((tx, ty, bbox[2] - bbox[0], bbox[3] - bbox[1]))
+
+    return boxes
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+class IncrementalRenderer:
+    """Render rows into one reused canvas, touching only the regions text changed
+
+    The template is copied once. For each row, areas whose text differs from
+    the previous row have their old ink restored from the template and their
+    new text drawn; everything else is left as is. The returned image is
+    overwritten by the next call, so save or copy it first. Use one renderer
+    per thread or process.
+    """
+
+    def __init__(self, layout, sprites=None):
+        self.layout = layout
+        self.sprites = sprites or text_sprites
+        self.canvas = layout.template.copy()
+        self._bounds = (0, 0) + self.canvas.size
+        # (text, ink box) drawn in each area by the previous row
+        self._drawn = [(None, None)] * len(layout.areas)
+
+    def _place(self, area, text, placement=None):
+        font, bbox, (tx, ty) = placement or area.place(text)
+        sprite = self.sprites.get(font, text)
+        box = (max(tx + bbox[0], 0), max(ty + bbox[1], 0),
+               min(tx + bbox[2], self._bounds[2]), min(ty + bbox[3], self._bounds[3]))
+        return (tx, ty), box, sprite
+
+    def render(self, texts, placements=None):
+        """Bring the canvas up to date for one row of area texts and return it
+
+        placements, from measure_rows, saves measuring the texts again.
+        """
+        layout = self.layout
+        placed = {}
+        dirty = {i for i, text in enumerate(texts) if text != self._drawn[i][0]}
+
+        # Areas whose old or new ink overlaps a dirty region must be redrawn too,
+        # or restoring the template underneath would clip them
+        pending = list(dirty)
+        while pending:
+            i = pending.pop()
+            placed[i] = self._place(layout.plan[i], texts[i],
+                                    placements[i] if placements else None)
+            regions = [box for box in (self._drawn[i][1], placed[i][1]) if box]
+            for j, (text, box) in enumerate(self._drawn):
+                if j not in dirty and box and any(_overlaps(box, r) for r in regions):
+                    dirty.add(j)
+                    pending.append(j)
+
+        for i in dirty:
+            box = self._drawn[i][1]
+            if box and box[0] < box[2] and box[1] < box[3]:
+                self.canvas.paste(layout.template.crop(box), box[:2])
+
+        # Draw in area order so overlapping text stacks as in a full render
+        for i in sorted(dirty):
+            origin, box, sprite = placed[i]
+            paste_text(self.canvas, origin, sprite, layout.plan[i].style.color)
+            self._drawn[i] = (texts[i], box)
+
+        return self.canvas
@@ -1,16 +1,38 @@
-import os, re, sys
+import os, sys, time
+import queue, threading
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox, colorchooser, font, simpledialog
-from PIL import Image, ImageDraw, ImageFont, ImageTk
-import pandas as pd
+from PIL import Image, ImageTk
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-def sanitize_filename(s):
-    """Clean filename for safe saving"""
-    s = str(s)
-    s = re.sub(r'[\\/:"*?<>|]+', '', s)
-    s = re.sub(r'\s+', '_', s.strip())
-    return s if s else "unnamed"
+from certificate_fonts import font_registry, system_font_index
+from certificate_render import Layout, align_text, area_texts, render, sprite_image, text_sprites
+from certificate_batch import generate_batch, sanitize_filename
+from certificate_data import load_table, needed_columns, read_columns
+from certificate_layout import load_project, save_layout
+from certificate_pdf import VectorPdfWriter
+
+# Minimum time between preview renders while dragging (about one frame)
+PREVIEW_FRAME_MS = 16
+
+TEMPLATE_FILETYPES = [("Image files", "*.jpg *.jpeg *.png *.bmp *.tiff *.gif"),
+                      ("PNG files", "*.png"),
+                      ("JPEG files", "*.jpg *.jpeg"),
+                      ("All files", "*.*")]
+
+# Editor attribute holding each default font setting
+STYLE_ATTRS = {'family': 'font_family', 'style': 'font_style', 'size': 'font_size',
+               'alignment': 'alignment', 'color': 'text_color', 'fit': 'text_fit'}
+
+# How often the progress window checks on a running batch
+BATCH_POLL_MS = 100
+
+def format_duration(seconds):
+    """Seconds as m:ss, or h:mm:ss from an hour up"""
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
 
 def pick_file(title, filetypes):
     """File picker dialog with fallback options"""
@@ -109,37 +131,8 @@ def pick_file(title, filetypes):
 
 def get_system_fonts():
     """Get all available system fonts"""
-    fonts = set()
-    
-    # Common font directories
-    font_dirs = []
-    
-    if sys.platform == "win32":
-        font_dirs = [
-            "C:/Windows/Fonts/",
-            os.path.expanduser("~/AppData/Local/Microsoft/Windows/Fonts/")
-        ]
-    elif sys.platform == "darwin":  # macOS
-        font_dirs = [
-            "/System/Library/Fonts/",
-            "/Library/Fonts/",
-            os.path.expanduser("~/Library/Fonts/")
-        ]
-    else:  # Linux
-        font_dirs = [
-            "/usr/share/fonts/",
-            "/usr/local/share/fonts/",
-            os.path.expanduser("~/.fonts/"),
-            os.path.expanduser("~/.local/share/fonts/")
-        ]
-    
-    # Scan font directories
-    for font_dir in font_dirs:
-        if os.path.exists(font_dir):
-            for root, dirs, files in os.walk(font_dir):
-                for file in files:
-                    if file.lower().endswith(('.ttf', '.otf', '.ttc')):
-                        fonts.add(os.path.join(root, file))
+    # Installed font files come from the cached index instead of a full scan
+    fonts = system_font_index().paths()
     
     # Add common font names for fallback
     common_fonts = [
@@ -164,14 +157,18 @@ def get_system_fonts():
     return sorted(list(fonts)) + common_fonts
 
 class ProfessionalCertificateEditor:
-    def __init__(self, template, data, text_areas):
+    def __init__(self, template, data, text_areas, template_path=None, data_path=None,
+                 font_settings=None):
         self.template = template
+        self.template_path = template_path
+        self.data_path = data_path
         self.data = data  # DataFrame containing all data
         self.text_areas = text_areas  # List of dictionaries with 'rect' and 'column'
         self.index = 0
         self.font_size = 50
         self.alignment = "center"
         self.text_color = (0, 0, 0)
+        self.text_fit = False  # shrink text that overflows its area
         
         # Set initial text position to the center of the first text area if available
         if text_areas:
@@ -184,7 +181,17 @@ class ProfessionalCertificateEditor:
         self.font_family = "Times New Roman"
         self.font_style = "Regular"
         
+        # Settings saved with an opened project
+        if font_settings:
+            self.font_family = font_settings.get('family', self.font_family)
+            self.font_style = font_settings.get('style', self.font_style)
+            self.font_size = int(font_settings.get('size', self.font_size))
+            self.alignment = font_settings.get('alignment', self.alignment)
+            self.text_color = tuple(font_settings.get('color', self.text_color))
+            self.text_fit = bool(font_settings.get('fit', self.text_fit))
+        
         # Font management
+        font_registry.set_index(system_font_index())
         self.available_fonts = get_system_fonts()
         self.font_families = self._organize_fonts()
         
@@ -194,6 +201,8 @@ class ProfessionalCertificateEditor:
         # Text editing variables
         self.selected_text_area = None
         self.text_positions = {}  # Store positions for each text area
+        self.batch_cancel = None  # set to stop the batch running in the background
+        self.style_target = None  # area whose style the font controls edit; None for all
         
         # Create main window
         self.root = tk.Tk()
@@ -207,11 +216,23 @@ class ProfessionalCertificateEditor:
         
         self.setup_ui()
         self.update_preview()
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
         self.root.mainloop()
+    
+    def close(self):
+        """Close the editor, stopping any batch still running"""
+        if self.batch_cancel is not None:
+            self.batch_cancel.set()
+        self.root.destroy()
         
     def _organize_fonts(self):
         """Organize fonts by family"""
-        families = {}
+        # List the families actually installed when the index found any
+        families = system_font_index().families()
+        if families:
+            if self.font_family not in families:
+                families[self.font_family] = ["Regular", "Bold", "Italic", "Bold Italic"]
+            return dict(sorted(families.items()))
         
         # Add common font families
         common_families = {
@@ -239,44 +260,12 @@ class ProfessionalCertificateEditor:
         return families
         
     def _load_font(self):
-        """Load the current font"""
-        try:
-            # Try to load system font by name first
-            font_name = self.font_family
-            if self.font_style != "Regular":
-                font_name += f" {self.font_style}"
-            
-            self.font = ImageFont.truetype(font_name, self.font_size)
-        except:
-            # Try common font files
-            font_files = {
-                ("Times New Roman", "Regular"): ["times.ttf", "TimesNewRomanPSMT.ttf"],
-                ("Times New Roman", "Bold"): ["timesbd.ttf", "TimesNewRomanPS-BoldMT.ttf"],
-                ("Times New Roman", "Italic"): ["timesi.ttf", "TimesNewRomanPS-ItalicMT.ttf"],
-                ("Times New Roman", "Bold Italic"): ["timesbi.ttf", "TimesNewRomanPS-BoldItalicMT.ttf"],
-                ("Arial", "Regular"): ["arial.ttf", "ArialMT.ttf"],
-                ("Arial", "Bold"): ["arialbd.ttf", "Arial-BoldMT.ttf"],
-                ("Arial", "Italic"): ["ariali.ttf", "Arial-ItalicMT.ttf"],
-                ("Arial", "Bold Italic"): ["arialbi.ttf", "Arial-BoldItalicMT.ttf"],
-                ("Calibri", "Regular"): ["calibri.ttf"],
-                ("Calibri", "Bold"): ["calibrib.ttf"],
-                ("Calibri", "Italic"): ["calibrii.ttf"],
-                ("Calibri", "Bold Italic"): ["calibriz.ttf"],
-            }
-            
-            key = (self.font_family, self.font_style)
-            if key in font_files:
-                for font_file in font_files[key]:
-                    try:
-                        self.font = ImageFont.truetype(font_file, self.font_size)
-                        break
-                    except:
-                        continue
-                else:
-                    # If no specific font found, use default
-                    self.font = ImageFont.load_default()
-            else:
-                self.font = ImageFont.load_default()
+        """Load the font of the current style target"""
+        # Resolved once per family/style; faces are cached per size
+        settings = self._target_style()
+        self.font_resolution = font_registry.resolve(settings['family'], settings['style'])
+        self.font = font_registry.load(self.font_resolution.path, settings['size'],
+                                       self.font_resolution.face)
                 
     def setup_ui(self):
         """Setup the user interface"""
@@ -302,8 +291,7 @@ class ProfessionalCertificateEditor:
         # Title
         title_frame = ttk.Frame(parent)
         title_frame.pack(fill="x", pady=(0, 20))
-        ttk.Label(title_frame, text="Kalash
-        Certificate Editor", 
+        ttk.Label(title_frame, text="Kalash Certificate Editor", 
                  font=("Arial", 14, "bold")).pack()
         
         # Save All button at the top
@@ -337,6 +325,15 @@ class ProfessionalCertificateEditor:
         font_frame = ttk.LabelFrame(parent, text="Font Settings", padding=10)
         font_frame.pack(fill="x", pady=(0, 10))
         
+        # Which area the font, size, alignment and colour controls apply to
+        ttk.Label(font_frame, text="Style For:").pack(anchor="w")
+        self.style_target_var = tk.StringVar(value="All areas")
+        self.style_target_combo = ttk.Combobox(font_frame, textvariable=self.style_target_var,
+                                             values=self._style_targets(), state="readonly",
+                                             width=25)
+        self.style_target_combo.pack(fill="x", pady=(0, 10))
+        self.style_target_combo.bind("<<ComboboxSelected>>", self.on_style_target_change)
+        
         # Font family
         ttk.Label(font_frame, text="Font Family:").pack(anchor="w")
         self.font_family_var = tk.StringVar(value=self.font_family)
@@ -369,6 +366,13 @@ class ProfessionalCertificateEditor:
         ttk.Button(size_frame, text="+", width=3, 
                   command=self.increase_size).pack(side="left")
         
+        self.fit_var = tk.BooleanVar(value=self.text_fit)
+        ttk.Checkbutton(font_frame, text="Shrink to fit the area", variable=self.fit_var,
+                       command=self.on_fit_change).pack(anchor="w", pady=(0, 10))
+        
+        self.font_file_label = ttk.Label(font_frame, text="", foreground="gray")
+        self.font_file_label.pack(anchor="w", pady=(0, 10))
+        
         # Alignment
         align_frame = ttk.Frame(font_frame)
         align_frame.pack(fill="x", pady=(0, 10))
@@ -430,6 +434,8 @@ class ProfessionalCertificateEditor:
                   command=self.save_current).pack(fill="x", pady=(0, 5))
         ttk.Button(save_frame, text="📄 Save Current as PDF Only", 
                   command=self.save_current_pdf).pack(fill="x", pady=(0, 5))
+        ttk.Button(save_frame, text="🔤 Save Current as Vector PDF", 
+                  command=self.save_current_vector_pdf).pack(fill="x", pady=(0, 5))
         
         # All certificates options
         ttk.Label(save_frame, text="All Certificates:", font=("Arial", 10, "bold")).pack(anchor="w", pady=(10, 0))
@@ -437,6 +443,11 @@ class ProfessionalCertificateEditor:
                   command=self.generate_all).pack(fill="x", pady=(0, 5))
         ttk.Button(save_frame, text="📄 Generate All as PDF Only", 
                   command=self.generate_all_pdf).pack(fill="x", pady=(0, 5))
+        ttk.Button(save_frame, text="📚 Generate Combined PDF", 
+                  command=self.generate_combined_pdf).pack(fill="x", pady=(0, 5))
+        self.overlay_pdf_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(save_frame, text="Overlay PDFs (smaller, faster)",
+                       variable=self.overlay_pdf_var).pack(anchor="w")
         
         # Other actions
         action_frame = ttk.LabelFrame(parent, text="Other Actions", padding=10)
@@ -444,6 +455,8 @@ class ProfessionalCertificateEditor:
         
         ttk.Button(action_frame, text="🔄 Reset Settings", 
                   command=self.reset_settings).pack(fill="x", pady=(0, 5))
+        ttk.Button(action_frame, text="🗂 Save Project", 
+                  command=self.save_layout).pack(fill="x", pady=(0, 5))
         
         # Preview settings
         preview_frame = ttk.LabelFrame(parent, text="Preview Options", padding=10)
@@ -480,37 +493,102 @@ class ProfessionalCertificateEditor:
         self.canvas.bind("<Double-Button-1>", self.edit_text)
         self.canvas.bind("<ButtonPress-3>", self.start_resize)
         self.canvas.bind("<B3-Motion>", self.do_resize)
+        self.canvas.bind("<ButtonRelease-3>", self.end_resize)
         self.canvas.bind("<MouseWheel>", self.on_mousewheel)
         
         self.drag_data = {"x": 0, "y": 0, "item": None}
         self.resize_data = {"y": 0}
         
+        # Pending coalesced preview render, see schedule_preview
+        self._preview_job = None
+        self._preview_template = None
+        
+        # Canvas items of the preview, see update_preview
+        self._preview_background = None
+        self._preview_scale = 1.0
+        self._preview_layout = None
+        self._area_items = []
+        
+    def _style_targets(self):
+        """Choices of the style target combobox"""
+        return ["All areas"] + [f"{i + 1}: {area['column']}" for i, area in enumerate(self.text_areas)]
+        
+    def _target_style(self):
+        """Font settings of the style target: the defaults plus the area's own"""
+        settings = self._font_settings()
+        if self.style_target is not None:
+            settings.update(self.text_areas[self.style_target].get('style', {}))
+        return settings
+        
+    def _set_style(self, key, value):
+        """Apply one font setting to the style target
+        
+        For all areas it becomes the default and replaces that setting in
+        every area; for one area it is stored with the area, unless it matches
+        the default anyway.
+        """
+        if self.style_target is None:
+            setattr(self, STYLE_ATTRS[key], value)
+            areas = self.text_areas
+        else:
+            area = self.text_areas[self.style_target]
+            area.setdefault('style', {})[key] = value
+            areas = [area] if value == self._font_settings()[key] else []
+        
+        for area in areas:
+            area.get('style', {}).pop(key, None)
+            if 'style' in area and not area['style']:
+                del area['style']
+        if key in ('family', 'style', 'size'):
+            self._load_font()
+        
+    def _show_target_style(self):
+        """Set the font controls to the style target's settings"""
+        settings = self._target_style()
+        self.font_family_var.set(settings['family'])
+        self.font_style_combo['values'] = self.font_families.get(settings['family'], ["Regular"])
+        self.font_style_var.set(settings['style'])
+        self.size_var.set(settings['size'])
+        self.align_var.set(settings['alignment'])
+        self.fit_var.set(settings['fit'])
+        
+    def on_style_target_change(self, event=None):
+        """Switch the font controls to another area, or to all areas"""
+        index = self.style_target_combo.current()
+        self.style_target = index - 1 if index > 0 else None
+        self._show_target_style()
+        self._load_font()
+        self.update_preview()
+        
     def on_font_family_change(self, event=None):
         """Handle font family change"""
-        self.font_family = self.font_family_var.get()
+        family = self.font_family_var.get()
         # Update style options
-        styles = self.font_families.get(self.font_family, ["Regular"])
+        styles = self.font_families.get(family, ["Regular"])
         self.font_style_combo['values'] = styles
-        self.font_style = styles[0]
-        self.font_style_var.set(self.font_style)
-        self._load_font()
+        self.font_style_var.set(styles[0])
+        self._set_style('family', family)
+        self._set_style('style', styles[0])
         self.update_preview()
         
     def on_font_style_change(self, event=None):
         """Handle font style change"""
-        self.font_style = self.font_style_var.get()
-        self._load_font()
+        self._set_style('style', self.font_style_var.get())
         self.update_preview()
         
     def on_size_change(self):
         """Handle font size change from spinbox"""
-        self.font_size = self.size_var.get()
-        self._load_font()
+        self._set_style('size', self.size_var.get())
         self.update_preview()
         
     def on_alignment_change(self, event=None):
         """Handle alignment change"""
-        self.alignment = self.align_var.get()
+        self._set_style('alignment', self.align_var.get())
+        self.update_preview()
+        
+    def on_fit_change(self):
+        """Turn shrinking overflowing text to fit its area on or off"""
+        self._set_style('fit', self.fit_var.get())
         self.update_preview()
         
     def on_mousewheel(self, event):
@@ -519,107 +597,173 @@ class ProfessionalCertificateEditor:
         
     def set_color(self, rgb):
         """Set text color"""
-        self.text_color = rgb
+        self._set_style('color', rgb)
         self.update_preview()
         
     def pick_custom_color(self):
         """Pick custom color"""
         color = colorchooser.askcolor(title="Choose Text Color")[0]
         if color:
-            self.text_color = tuple(int(c) for c in color)
+            self._set_style('color', tuple(int(c) for c in color))
             self.update_preview()
             
+    def _font_settings(self):
+        """Font settings handed to the batch generator"""
+        return {
+            'family': self.font_family,
+            'style': self.font_style,
+            'size': self.font_size,
+            'alignment': self.alignment,
+            'color': self.text_color,
+            'fit': self.text_fit,
+        }
+        
+    def _layout(self):
+        """Snapshot of the current areas and font settings for the renderer"""
+        return Layout.from_settings(self.template, self.text_areas, self._font_settings(),
+                                    template_path=self.template_path)
+        
     def get_current_name(self):
         """Get current name being edited (from the first column)"""
         if self.data.shape[1] > 0:
             return str(self.data.iloc[self.index, 0])
         return "No data"
         
-    def render_image(self, show_guides=True):
-        """Render certificate with all text areas for the current row"""
-        img = self.template.copy()
-        draw = ImageDraw.Draw(img)
-        
+    def _current_texts(self):
+        """Current row and the custom text to draw for each area"""
         # Get the current row from the DataFrame
         current_row = self.data.iloc[self.index]
         
-        # For each text area
+        # Track each area's centre and text so edits and drags can refer to them
         for i, area in enumerate(self.text_areas):
             rect = area['rect']
-            column = area['column']
-            
-            # Get the text for this area from the current row
-            # If we have custom text for this area, use it
-            if i in self.text_positions and 'text' in self.text_positions[i]:
-                text = self.text_positions[i]['text']
-            else:
-                text = str(current_row[column])
-            
-            # Get text dimensions
-            bbox = draw.textbbox((0, 0), text, font=self.font)
-            tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
-            
-            # Calculate position based on alignment (using the current alignment setting for all)
-            if self.alignment == "center":
-                tx = (rect[0] + rect[2]) // 2 - tw // 2
-            elif self.alignment == "left":
-                tx = rect[0]
-            else:  # right
-                tx = rect[2] - tw
             
-            ty = (rect[1] + rect[3]) // 2 - th // 2
-            
-            # Store position for this text area if not already stored
             if i not in self.text_positions:
-                self.text_positions[i] = {
-                    'x': (rect[0] + rect[2]) // 2,
-                    'y': (rect[1] + rect[3]) // 2,
-                    'text': text
-                }
+                self.text_positions[i] = {}
+            if 'text' not in self.text_positions[i]:
+                self.text_positions[i]['text'] = str(current_row[area['column']])
             
-            # Update stored position if it exists
             self.text_positions[i]['x'] = (rect[0] + rect[2]) // 2
             self.text_positions[i]['y'] = (rect[1] + rect[3]) // 2
-            
-            # Draw text
-            draw.text((tx, ty), text, font=self.font, fill=self.text_color)
-            
-            # Draw guides if enabled
-            if show_guides and self.show_guides_var.get():
-                # Text boundary
-                draw.rectangle([tx, ty, tx + tw, ty + th], outline="red", width=2)
-                # Rectangle area
-                draw.rectangle([rect[0], rect[1], rect[2], rect[3]], outline="blue", width=1)
         
-        return img
+        overrides = {i: pos['text'] for i, pos in self.text_positions.items()}
+        return current_row, overrides
+        
+    def render_image(self, show_guides=True):
+        """Render certificate with all text areas for the current row"""
+        current_row, overrides = self._current_texts()
+        return render(self._layout(), current_row, overrides,
+                      show_guides=show_guides and self.show_guides_var.get())
+        
+    def _display_template(self, size):
+        """Template resized for the canvas, cached until the display size changes"""
+        if self._preview_template is None or self._preview_template.size != size:
+            self._preview_template = self.template.resize(size, Image.LANCZOS)
+        return self._preview_template
+        
+    def schedule_preview(self):
+        """Queue a preview render, merging requests into at most one per frame"""
+        if self._preview_job is None:
+            self._preview_job = self.root.after(PREVIEW_FRAME_MS, self._run_scheduled_preview)
+            
+    def _run_scheduled_preview(self):
+        """Render the preview queued by schedule_preview"""
+        self._preview_job = None
+        self.update_preview()
+        
+    def flush_preview(self):
+        """Drop any queued render and draw the preview now"""
+        if self._preview_job is not None:
+            self.root.after_cancel(self._preview_job)
+            self._preview_job = None
+        self.update_preview()
         
     def update_preview(self):
-        """Update canvas preview"""
-        img = self.render_image(show_guides=True)
+        """Update canvas preview
+        
+        The template, pre-scaled to the canvas once, is a single static canvas
+        image. Each text area is its own sprite item rendered at display scale
+        with the layout (rects and font size) scaled by the same factor, so
+        dragging only moves items and never re-renders the bitmap.
+        """
+        current_row, overrides = self._current_texts()
         
         # Calculate display size
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
         
         if canvas_width > 1 and canvas_height > 1:  # Canvas is initialized
-            scale = min(canvas_width / img.width, canvas_height / img.height, 1.0)
-            disp_w = int(img.width * scale)
-            disp_h = int(img.height * scale)
+            scale = min(canvas_width / self.template.width,
+                        canvas_height / self.template.height, 1.0)
+            disp_w = int(self.template.width * scale)
+            disp_h = int(self.template.height * scale)
             
             if disp_w > 0 and disp_h > 0:
-                disp_img = img.resize((disp_w, disp_h), Image.LANCZOS)
-                self.tk_img = ImageTk.PhotoImage(disp_img)
+                template = self._display_template((disp_w, disp_h))
                 
-                self.canvas.delete("all")
-                self.canvas.create_image(disp_w//2, disp_h//2, image=self.tk_img)
+                # The template image is only replaced when the display size changes
+                if self._preview_background is not template:
+                    self.tk_img = ImageTk.PhotoImage(template)
+                    self.canvas.delete("all")
+                    self.canvas.create_image(0, 0, anchor="nw", image=self.tk_img, tags="template")
+                    self._preview_background = template
+                    
+                    # Update scroll region
+                    self.canvas.configure(scrollregion=self.canvas.bbox("all"))
                 
-                # Update scroll region
-                self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+                self._preview_scale = scale
+                self._preview_layout = self._layout().scaled(scale, template)
+                self._draw_area_items(area_texts(self._preview_layout, current_row, overrides))
         
         # Update labels
         self.name_label.config(text=self.get_current_name())
         self.index_label.config(text=f"Record {self.index + 1} of {len(self.data)}")
         self.pos_label.config(text=f"Position: ({self.text_x}, {self.text_y})")
+        if self.font_resolution.is_default:
+            self.font_file_label.config(text="Font file: not found, using built-in font")
+        else:
+            self.font_file_label.config(text=f"Font file: {os.path.basename(self.font_resolution.path)}")
+        
+    def _draw_area_items(self, texts):
+        """Recreate the sprite and guide items for every text area"""
+        layout = self._preview_layout
+        show_guides = self.show_guides_var.get()
+        self.canvas.delete("area")
+        self._area_items = []
+        
+        for area, text in zip(layout.plan, texts):
+            sprite = text_sprites.get(area.font_for(text), text)
+            image = sprite_image(sprite, area.style.color)
+            items = {'bbox': sprite[1], 'photo': ImageTk.PhotoImage(image) if image else None}
+            
+            if items['photo']:
+                items['text'] = self.canvas.create_image(0, 0, anchor="nw", image=items['photo'],
+                                                         tags="area")
+            if show_guides:
+                # Text boundary and rectangle area
+                items['box'] = self.canvas.create_rectangle(0, 0, 0, 0, outline="red", width=2,
+                                                            tags="area")
+                items['rect'] = self.canvas.create_rectangle(0, 0, 0, 0, outline="blue", width=1,
+                                                             tags="area")
+            self._area_items.append(items)
+        
+        self._place_area_items(range(len(self._area_items)))
+        
+    def _place_area_items(self, indices):
+        """Move the canvas items of the given areas to match their rects"""
+        scale = self._preview_scale
+        for i in indices:
+            items = self._area_items[i]
+            rect = tuple(int(round(int(round(v)) * scale)) for v in self.text_areas[i]['rect'])
+            bbox = items['bbox']
+            tx, ty = align_text(rect, bbox, self._preview_layout.plan[i].style.alignment)
+            
+            if 'text' in items:
+                self.canvas.coords(items['text'], tx + bbox[0], ty + bbox[1])
+            if 'box' in items:
+                self.canvas.coords(items['box'], tx, ty,
+                                   tx + bbox[2] - bbox[0], ty + bbox[3] - bbox[1])
+                self.canvas.coords(items['rect'], *rect)
         
     def next_name(self):
         """Navigate to next name"""
@@ -635,16 +779,16 @@ class ProfessionalCertificateEditor:
         
     def increase_size(self):
         """Increase font size"""
-        self.font_size += 2
-        self.size_var.set(self.font_size)
-        self._load_font()
+        size = self._target_style()['size'] + 2
+        self.size_var.set(size)
+        self._set_style('size', size)
         self.update_preview()
         
     def decrease_size(self):
         """Decrease font size"""
-        self.font_size = max(10, self.font_size - 2)
-        self.size_var.set(self.font_size)
-        self._load_font()
+        size = max(10, self._target_style()['size'] - 2)
+        self.size_var.set(size)
+        self._set_style('size', size)
         self.update_preview()
         
     def start_move(self, event):
@@ -690,9 +834,11 @@ class ProfessionalCertificateEditor:
             dx = (event.x - self.drag_data["x"]) / scale
             dy = (event.y - self.drag_data["y"]) / scale
             
+            moved = []
             if self.selected_text_area is not None:
                 # Move the selected text area
                 if self.selected_text_area in self.text_positions:
+                    moved.append(self.selected_text_area)
                     self.text_positions[self.selected_text_area]['x'] += dx
                     self.text_positions[self.selected_text_area]['y'] += dy
                     
@@ -712,6 +858,7 @@ class ProfessionalCertificateEditor:
             else:
                 # Move all text areas (default behavior)
                 for i in self.text_positions:
+                    moved.append(i)
                     self.text_positions[i]['x'] += dx
                     self.text_positions[i]['y'] += dy
                     
@@ -732,12 +879,17 @@ class ProfessionalCertificateEditor:
             self.drag_data["x"] = event.x
             self.drag_data["y"] = event.y
             
-            self.update_preview()
+            # Only the text items move; nothing is re-rendered while dragging
+            if len(self._area_items) == len(self.text_areas):
+                self._place_area_items(moved)
+            else:
+                self.schedule_preview()
             
     def end_move(self, event):
         """End text movement"""
         self.selected_text_area = None
         self.canvas.configure(cursor="crosshair")
+        self.flush_preview()
         
     def edit_text(self, event):
         """Edit text content on double-click"""
@@ -815,11 +967,16 @@ class ProfessionalCertificateEditor:
     def do_resize(self, event):
         """Handle font resizing"""
         dy = event.y - self.resize_data["y"]
-        self.font_size = max(10, self.font_size + dy // 3)
-        self.size_var.set(self.font_size)
+        size = max(10, self._target_style()['size'] + dy // 3)
+        self.size_var.set(size)
+        self._set_style('size', size)
         self.resize_data["y"] = event.y
-        self._load_font()
-        self.update_preview()
+        self.schedule_preview()
+        
+    def end_resize(self, event):
+        """End font resizing"""
+        self.canvas.configure(cursor="crosshair")
+        self.flush_preview()
         
     def save_current(self):
         """Save current certificate as both PDF and PNG"""
@@ -865,6 +1022,47 @@ class ProfessionalCertificateEditor:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save certificate:\n{str(e)}")
         
+    def save_current_vector_pdf(self):
+        """Save current certificate as a PDF with real text over the template"""
+        try:
+            output_dir = "Certificates"
+            os.makedirs(output_dir, exist_ok=True)
+            
+            # Use the first column value for filename
+            name = self.get_current_name()
+            current_row, overrides = self._current_texts()
+            layout = self._layout()
+            safe_name = sanitize_filename(name)
+            
+            pdf_path = os.path.join(output_dir, f"{safe_name}.pdf")
+            with VectorPdfWriter(pdf_path, layout) as pdf:
+                pdf.add_texts(area_texts(layout, current_row, overrides))
+            
+            messagebox.showinfo("Certificate Saved", 
+                              f"Certificate saved successfully as vector PDF!\n\nPDF: {pdf_path}")
+        except ImportError as e:
+            messagebox.showerror("Missing Library", str(e))
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save certificate:\n{str(e)}")
+        
+    def save_layout(self):
+        """Save the template, data file, text areas and font settings as a project"""
+        path = filedialog.asksaveasfilename(title="Save Project", defaultextension=".json",
+                                            filetypes=[("Project files", "*.json")],
+                                            parent=self.root)
+        if not path:
+            return
+        
+        try:
+            save_layout(path, self.text_areas, self._font_settings(),
+                        template_path=self.template_path, data_path=self.data_path)
+            messagebox.showinfo("Project Saved", 
+                              f"Project saved successfully!\n\n{path}\n\n"
+                              f"Reopen it with \"Open Project\", or run batches without the editor using:\n"
+                              f"python certificate_cli.py --layout \"{path}\"")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save project:\n{str(e)}")
+        
     def reset_settings(self):
         """Reset all settings to defaults"""
         self.font_size = 50
@@ -872,142 +1070,192 @@ class ProfessionalCertificateEditor:
             rect = self.text_areas[0]['rect']
             self.text_x, self.text_y = (rect[0] + rect[2]) // 2, (rect[1] + rect[3]) // 2
         else:
-            self.text_x, self.text_y = self.template.width // 2, template.height // 2
+            self.text_x, self.text_y = self.template.width // 2, self.template.height // 2
             
         self.alignment = "center"
         self.text_color = (0, 0, 0)
+        self.text_fit = False
         self.font_family = "Times New Roman"
         self.font_style = "Regular"
         
+        # Every area goes back to the shared style
+        for area in self.text_areas:
+            area.pop('style', None)
+        self.style_target = None
+        self.style_target_var.set("All areas")
+        
         # Reset custom text positions
         self.text_positions = {}
         
         # Update UI
-        self.align_var.set(self.alignment)
-        self.size_var.set(self.font_size)
-        self.font_family_var.set(self.font_family)
-        self.font_style_var.set(self.font_style)
+        self._show_target_style()
         
         self._load_font()
         self.update_preview()
         
         messagebox.showinfo("Settings Reset", "All settings have been reset to defaults.")
         
-    def generate_all(self):
-        """Generate all certificates (PDF and PNG)"""
+    def _run_batch(self, title, message, formats, finished, failed, **options):
+        """Generate every certificate in the background, with a progress window
+
+        The batch runs on a worker thread (which hands rows to worker
+        processes) while the editor stays responsive; progress comes back
+        through a queue polled from the Tk loop. finished(output_dir) is called
+        once it completes, and failed titles the error shown if it doesn't.
+        """
+        if self.batch_cancel is not None:
+            messagebox.showinfo("Batch Running", "Certificates are already being generated.\n\n"
+                                "Wait for that batch to finish or cancel it first.")
+            return
+        # Built before any window opens, so a bad font or area is just an error dialog
         try:
+            layout = self._layout()
             output_dir = "Certificates"
             os.makedirs(output_dir, exist_ok=True)
+        except Exception as e:
+            messagebox.showerror("Error", f"{failed}:\n{str(e)}")
+            return
+        
+        progress_window = tk.Toplevel(self.root)
+        progress_window.title(title)
+        progress_window.geometry("400x200")
+        progress_window.transient(self.root)
+        
+        ttk.Label(progress_window, text=message).pack(pady=(20, 10))
+        
+        progress_var = tk.DoubleVar()
+        progress_bar = ttk.Progressbar(progress_window, variable=progress_var, 
+                                     maximum=len(self.data))
+        progress_bar.pack(padx=20, fill="x")
+        
+        status_label = ttk.Label(progress_window, text="Starting...")
+        status_label.pack(pady=(10, 0))
+        rate_label = ttk.Label(progress_window, text="")
+        rate_label.pack(pady=(0, 10))
+        
+        pause, cancel = threading.Event(), threading.Event()
+        updates = queue.Queue()
+        started = time.monotonic()
+        paused_at, paused_for = None, 0.0
+        
+        def toggle_pause():
+            nonlocal paused_at, paused_for
+            if pause.is_set():
+                paused_for += time.monotonic() - paused_at
+                paused_at = None
+                pause.clear()
+                pause_button.config(text="⏸ Pause")
+            else:
+                paused_at = time.monotonic()
+                pause.set()
+                pause_button.config(text="▶ Resume")
+                status_label.config(text="Paused (rows in progress still finish)")
+        
+        def cancel_batch():
+            cancel.set()
+            pause_button.config(state="disabled")
+            cancel_button.config(state="disabled")
+            status_label.config(text="Cancelling after the rows in progress...")
+        
+        button_frame = ttk.Frame(progress_window)
+        button_frame.pack()
+        pause_button = ttk.Button(button_frame, text="⏸ Pause", command=toggle_pause)
+        pause_button.pack(side="left", padx=5)
+        cancel_button = ttk.Button(button_frame, text="✖ Cancel", command=cancel_batch)
+        cancel_button.pack(side="left", padx=5)
+        progress_window.protocol("WM_DELETE_WINDOW", cancel_batch)
+        
+        def show(done, total):
+            if total is not None:
+                progress_bar.configure(maximum=total)
+            progress_var.set(done)
+            if pause.is_set() or cancel.is_set():
+                return
+            status_label.config(text=f"Generated {done} of {total if total is not None else '?'}")
             
-            progress_window = tk.Toplevel(self.root)
-            progress_window.title("Generating Certificates")
-            progress_window.geometry("400x150")
-            progress_window.transient(self.root)
-            progress_window.grab_set()
-            
-            ttk.Label(progress_window, text="Generating certificates (PDF+PNG)...").pack(pady=20)
-            
-            progress_var = tk.DoubleVar()
-            progress_bar = ttk.Progressbar(progress_window, variable=progress_var, 
-                                         maximum=len(self.data))
-            progress_bar.pack(padx=20, fill="x")
-            
-            status_label = ttk.Label(progress_window, text="")
-            status_label.pack(pady=10)
-            
-            # Save current text positions to restore later
-            saved_text_positions = self.text_positions.copy()
-            
-            for i in range(len(self.data)):
-                self.index = i
-                status_label.config(text=f"Processing: {self.get_current_name()}")
-                progress_window.update()
-                
-                # Reset text positions for each certificate
-                self.text_positions = {}
-                
-                img = self.render_image(show_guides=False)
-                safe_name = sanitize_filename(self.get_current_name())
-                
-                # Save PDF
-                pdf_path = os.path.join(output_dir, f"{safe_name}.pdf")
-                img.save(pdf_path, "PDF", resolution=300.0, quality=100)
-                
-                # Save PNG
-                png_path = os.path.join(output_dir, f"{safe_name}.png")
-                img.save(png_path, "PNG", dpi=(300, 300))
-                
-                progress_var.set(i + 1)
-            
-            # Restore text positions
-            self.text_positions = saved_text_positions
-            self.index = 0
+            elapsed = time.monotonic() - started - paused_for
+            rate = done / elapsed if elapsed > 0 else 0.0
+            if rate and total is not None:
+                rate_label.config(text=f"{rate:.1f} rows/s, about "
+                                       f"{format_duration((total - done) / rate)} left")
+            else:
+                rate_label.config(text=f"{rate:.1f} rows/s")
+        
+        def poll():
+            latest = None
+            while True:
+                try:
+                    latest = updates.get_nowait()
+                except queue.Empty:
+                    break
+            if latest is not None:
+                show(*latest)
+            if not batch.done():
+                progress_window.after(BATCH_POLL_MS, poll)
+                return
             
+            self.batch_cancel = None
             progress_window.destroy()
-            
+            error = batch.exception()
+            if error is not None:
+                messagebox.showerror("Error", f"{failed}:\n{str(error)}")
+            elif cancel.is_set():
+                messagebox.showinfo("Generation Cancelled",
+                                    f"Stopped after {batch.result()} certificates.\n\n"
+                                    f"Generate again to finish the rest; "
+                                    f"certificates already saved are kept.")
+            else:
+                finished(output_dir)
+        
+        # Rows are rendered and saved by worker processes; rows whose data
+        # and settings haven't changed since the last run are left as they are.
+        # progress runs on the batch thread, so it only queues the numbers
+        executor = ThreadPoolExecutor(max_workers=1)
+        batch = executor.submit(generate_batch, layout, self.data, output_dir,
+                                formats=formats, progress=lambda *p: updates.put(p),
+                                resume=True, pause=pause, cancel=cancel, **options)
+        executor.shutdown(wait=False)
+        self.batch_cancel = cancel
+        progress_window.after(BATCH_POLL_MS, poll)
+    
+    def _pdf_backend(self):
+        """The batch PDF backend: raster like Save Current unless overlay is ticked"""
+        return "overlay" if self.overlay_pdf_var.get() else "raster"
+    
+    def generate_all(self):
+        """Generate all certificates (PDF and PNG)"""
+        def finished(output_dir):
             messagebox.showinfo("Generation Complete", 
                               f"All {len(self.data)} certificates have been generated!\n\n"
                               f"Files saved in: {os.path.abspath(output_dir)}")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to generate certificates:\n{str(e)}")
+        
+        self._run_batch("Generating Certificates", "Generating certificates (PDF+PNG)...",
+                        ("pdf", "png"), finished, "Failed to generate certificates",
+                        pdf_backend=self._pdf_backend())
     
     def generate_all_pdf(self):
         """Generate all certificates as PDF only"""
-        try:
-            output_dir = "Certificates"
-            os.makedirs(output_dir, exist_ok=True)
-            
-            progress_window = tk.Toplevel(self.root)
-            progress_window.title("Generating PDF Certificates")
-            progress_window.geometry("400x150")
-            progress_window.transient(self.root)
-            progress_window.grab_set()
-            
-            ttk.Label(progress_window, text="Generating PDF certificates only...").pack(pady=20)
-            
-            progress_var = tk.DoubleVar()
-            progress_bar = ttk.Progressbar(progress_window, variable=progress_var, 
-                                         maximum=len(self.data))
-            progress_bar.pack(padx=20, fill="x")
-            
-            status_label = ttk.Label(progress_window, text="")
-            status_label.pack(pady=10)
-            
-            # Save current text positions to restore later
-            saved_text_positions = self.text_positions.copy()
-            
-            for i in range(len(self.data)):
-                self.index = i
-                status_label.config(text=f"Processing: {self.get_current_name()}")
-                progress_window.update()
-                
-                # Reset text positions for each certificate
-                self.text_positions = {}
-                
-                img = self.render_image(show_guides=False)
-                safe_name = sanitize_filename(self.get_current_name())
-                
-                # Save PDF only
-                pdf_path = os.path.join(output_dir, f"{safe_name}.pdf")
-                img.save(pdf_path, "PDF", resolution=300.0, quality=100)
-                
-                progress_var.set(i + 1)
-            
-            # Restore text positions
-            self.text_positions = saved_text_positions
-            self.index = 0
-            
-            progress_window.destroy()
-            
+        def finished(output_dir):
             messagebox.showinfo("PDF Generation Complete", 
                               f"All {len(self.data)} certificates have been generated as PDF!\n\n"
                               f"Files saved in: {os.path.abspath(output_dir)}")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to generate PDF certificates:\n{str(e)}")
+        
+        self._run_batch("Generating PDF Certificates", "Generating PDF certificates only...",
+                        ("pdf",), finished, "Failed to generate PDF certificates",
+                        pdf_backend=self._pdf_backend())
+    
+    def generate_combined_pdf(self):
+        """Generate all certificates into a single multi-page PDF"""
+        def finished(output_dir):
+            messagebox.showinfo("PDF Generation Complete", 
+                              f"All {len(self.data)} certificates have been saved in one PDF!\n\n"
+                              f"File: {os.path.abspath(os.path.join(output_dir, 'certificates.pdf'))}")
+        
+        self._run_batch("Generating Combined PDF", "Generating one PDF with every certificate...",
+                        ("pdf",), finished, "Failed to generate combined PDF",
+                        pdf_mode="combined", pdf_backend=self._pdf_backend())
 
-def select_text_areas(img, df):
+def select_text_areas(img, columns):
     """Interactive multiple text area selection with column assignment"""
     orig_w, orig_h = img.size
     
@@ -1072,7 +1320,7 @@ def select_text_areas(img, df):
             )
             
             # Get available columns (excluding already selected ones)
-            available_columns = [col for col in df.columns if col not in selected_columns]
+            available_columns = [col for col in columns if col not in selected_columns]
             
             if not available_columns:
                 messagebox.showinfo("All Columns Used", "All columns have been assigned to text areas.")
@@ -1154,10 +1402,15 @@ def select_text_areas(img, df):
     return result.get("text_areas", [])
 
 def load_names_from_excel():
-    """Load data from Excel file"""
+    """Pick the data file and read its column names; returns (path, columns)
+
+    Only the header is read here. The rows are loaded with load_data once the
+    text areas say which columns are needed.
+    """
     print("Opening file dialog for Excel file...")
     excel_path = pick_file("Select Excel file with data", 
-                          [("Excel files", "*.xlsx *.xls"), ("All files", "*.*")])
+                          [("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"),
+                           ("Parquet files", "*.parquet"), ("All files", "*.*")])
     
     if not excel_path:
         print("No Excel file selected")
@@ -1171,11 +1424,33 @@ def load_names_from_excel():
             messagebox.showerror("Error", f"File not found: {excel_path}")
             return None
         
-        print("Reading Excel file...")
-        # Read Excel file
-        df = pd.read_excel(excel_path)
-        print(f"Excel file loaded. Shape: {df.shape}")
-        print(f"Columns: {list(df.columns)}")
+        print("Reading column names...")
+        columns = read_columns(excel_path)
+        print(f"Columns: {columns}")
+        
+        if not columns:
+            messagebox.showerror("Error", "The Excel file is empty!")
+            return None
+        
+        return excel_path, columns
+    
+    except ImportError as e:
+        messagebox.showerror("Missing Library", 
+                           f"Required library missing: {str(e)}\n\n"
+                           f"Please install required packages:\n"
+                           f"pip install pandas openpyxl xlrd")
+        return None
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to load Excel file:\n{str(e)}")
+        print(f"Excel loading error: {e}")
+        return None
+
+def load_data(excel_path, columns, text_areas):
+    """Load just the columns the text areas use (plus the first, for file names)"""
+    try:
+        print("Reading data...")
+        df = load_table(excel_path, needed_columns(columns, text_areas))
+        print(f"Data loaded. Shape: {df.shape}")
         
         if df.empty:
             messagebox.showerror("Error", "The Excel file is empty!")
@@ -1194,6 +1469,68 @@ def load_names_from_excel():
         print(f"Excel loading error: {e}")
         return None
 
+def open_project():
+    """Pick a saved project and load what it records; returns the editor's arguments or None
+
+    The template and data file come from the project, and are only asked for
+    if they have moved. The text areas are used as saved.
+    """
+    print("Opening file dialog for project file...")
+    path = pick_file("Open Project", [("Project files", "*.json"), ("All files", "*.*")])
+    if not path:
+        print("No project selected")
+        return None
+    
+    try:
+        project = load_project(path)
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to open project:\n{str(e)}")
+        return None
+    print(f"✓ Project: {path} ({len(project.text_areas)} text areas)")
+    
+    template_path = project.template_path
+    if template_path is None or not os.path.exists(template_path):
+        if template_path:
+            print(f"Template not found: {template_path}")
+        template_path = pick_file("Select Certificate Template Image", TEMPLATE_FILETYPES)
+        if not template_path:
+            return None
+    elif project.template_changed():
+        if not messagebox.askyesno("Template Changed",
+                                   f"{os.path.basename(template_path)} has changed since the "
+                                   f"project was saved, so the text areas may not line up.\n\n"
+                                   f"Open it anyway?"):
+            return None
+    
+    data_path = project.data_path
+    if data_path and os.path.exists(data_path):
+        try:
+            columns = read_columns(data_path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load Excel file:\n{str(e)}")
+            return None
+    else:
+        selected = load_names_from_excel()
+        if selected is None:
+            return None
+        data_path, columns = selected
+    
+    missing = [area['column'] for area in project.text_areas if area['column'] not in columns]
+    if missing:
+        messagebox.showerror("Error", f"Columns missing from the data file:\n{', '.join(missing)}")
+        return None
+    
+    try:
+        img_template = Image.open(template_path).convert("RGB")
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to load template image:\n{str(e)}")
+        return None
+    
+    df = load_data(data_path, columns, project.text_areas)
+    if df is None:
+        return None
+    return img_template, df, project.text_areas, template_path, data_path, project.font_settings
+
 def main():
     """Main application entry point"""
     try:
@@ -1214,14 +1551,14 @@ def main():
         print("Showing welcome screen...")
         splash = tk.Tk()
         splash.title("Professional Certificate Editor")
-        splash.geometry("600x350")
+        splash.geometry("600x380")
         splash.configure(bg='#2c3e50')
         splash.resizable(False, False)
         
         # Center splash screen
         splash.update_idletasks()
         x = (splash.winfo_screenwidth() // 2) - (300)
-        y = (splash.winfo_screenheight() // 2) - (175)
+        y = (splash.winfo_screenheight() // 2) - (190)
         splash.geometry(f"+{x}+{y}")
         
         # Splash content
@@ -1245,7 +1582,8 @@ def main():
             "2. Choose Excel file with data (.xlsx, .xls)",
             "3. Mark the text areas on template and assign columns",
             "4. Customize fonts, colors, and positioning",
-            "5. Generate individual or batch certificates"
+            "5. Generate individual or batch certificates",
+            "Or open a saved project to skip straight to step 4"
         ]
         
         for step in steps:
@@ -1256,11 +1594,22 @@ def main():
         button_frame = tk.Frame(splash, bg='#2c3e50')
         button_frame.pack(pady=20)
         
+        choice = {}
+        
+        def choose_project():
+            choice['open_project'] = True
+            splash.destroy()
+        
         start_button = tk.Button(button_frame, text="🚀 Start Creating Certificates", 
                                 font=("Arial", 12, "bold"), bg='#3498db', fg='white',
                                 command=splash.destroy, cursor="hand2", padx=20, pady=10)
         start_button.pack(side='left', padx=5)
         
+        project_button = tk.Button(button_frame, text="📂 Open Project", 
+                                  font=("Arial", 10), bg='#27ae60', fg='white',
+                                  command=choose_project, cursor="hand2", padx=15, pady=8)
+        project_button.pack(side='left', padx=5)
+        
         exit_button = tk.Button(button_frame, text="❌ Exit", 
                                font=("Arial", 10), bg='#e74c3c', fg='white',
                                command=lambda: [splash.destroy(), sys.exit()], cursor="hand2", padx=15, pady=8)
@@ -1268,14 +1617,26 @@ def main():
         
         splash.mainloop()
         
+        if choice.get('open_project'):
+            # A saved project already has its template, data file and text areas
+            print("\n=== Opening Project ===")
+            opened = open_project()
+            if opened is None:
+                print("✗ Project opening cancelled or failed")
+                return
+            
+            img_template, df, text_areas, template_path, excel_path, font_settings = opened
+            print(f"✓ Loaded data: {df.shape[0]} rows, {df.shape[1]} columns")
+            print(f"   Starting editor...")
+            ProfessionalCertificateEditor(img_template, df, text_areas, template_path,
+                                          excel_path, font_settings)
+            print("=== Certificate Editor Session Ended ===")
+            return
+        
         # Step 1: Select template
         print("\n=== Step 1: Select Certificate Template ===")
         print("Opening file dialog for template image...")
-        template_path = pick_file("Select Certificate Template Image", 
-                                 [("Image files", "*.jpg *.jpeg *.png *.bmp *.tiff *.gif"), 
-                                  ("PNG files", "*.png"),
-                                  ("JPEG files", "*.jpg *.jpeg"),
-                                  ("All files", "*.*")])
+        template_path = pick_file("Select Certificate Template Image", TEMPLATE_FILETYPES)
         
         if not template_path:
             print("✗ Template selection cancelled")
@@ -1286,15 +1647,16 @@ def main():
         
         # Step 2: Load data from Excel
         print("\n=== Step 2: Load Data from Excel ===")
-        df = load_names_from_excel()
+        selected = load_names_from_excel()
         
-        if df is None:
+        if selected is None:
             print("✗ Data loading cancelled or failed")
             messagebox.showinfo("Cancelled", "Data loading cancelled.")
             return
         
-        print(f"✓ Loaded data: {df.shape[0]} rows, {df.shape[1]} columns")
-        print(f"   Columns: {list(df.columns)}")
+        excel_path, columns = selected
+        print(f"✓ Selected data: {len(columns)} columns")
+        print(f"   Columns: {columns}")
         
         # Step 3: Load template image
         print(f"\n=== Step 3: Loading Template Image ===")
@@ -1313,7 +1675,7 @@ def main():
         # Step 4: Select multiple text areas and assign columns
         print(f"\n=== Step 4: Select Text Areas ===")
         print("Opening text area selection window...")
-        text_areas = select_text_areas(img_template, df)
+        text_areas = select_text_areas(img_template, columns)
         
         if not text_areas:
             print("✗ Text area selection cancelled")
@@ -1324,6 +1686,13 @@ def main():
         for i, area in enumerate(text_areas):
             print(f"   Area {i+1}: {area['column']} at {area['rect']}")
         
+        # Only the columns the areas use are read from the file
+        df = load_data(excel_path, columns, text_areas)
+        if df is None:
+            return
+        
+        print(f"✓ Loaded data: {df.shape[0]} rows, {df.shape[1]} columns")
+        
         # Step 5: Start the editor
         print(f"\n=== Step 5: Starting Certificate Editor ===")
         print(f"✓ Configuration complete:")
@@ -1333,7 +1702,7 @@ def main():
         print(f"   Starting editor...")
         
         # Launch the professional editor
-        ProfessionalCertificateEditor(img_template, df, text_areas)
+        ProfessionalCertificateEditor(img_template, df, text_areas, template_path, excel_path)
         
         print("=== Certificate Editor Session Ended ===")
         
@@ -0,0 +1,56 @@
+"""Batch generation end to end: python -m pytest -q"""
+import os, time
+
+import pandas as pd
+from PIL import Image
+
+from certificate_batch import generate_batch
+from certificate_manifest import Manifest
+from certificate_render import Layout
+
+FONT = {'family': "DejaVu Sans", 'style': "Book", 'size': 40, 'alignment': "center",
+        'color': (20, 20, 120)}
+
+def _job(rows=40):
+    template = Image.new("RGB", (1200, 800), (250, 245, 230))
+    areas = [{'rect': (100, 200, 1100, 320), 'column': "Name"},
+             {'rect': (100, 450, 1100, 550), 'column': "Course"}]
+    layout = Layout.from_settings(template, areas, FONT)
+    data = pd.DataFrame({'Name': [f"Student {i}" for i in range(rows)],
+                         'Course': ["Python"] * rows})
+    return layout, data
+
+def test_pdf_and_png_from_parallel_workers(tmp_path):
+    layout, data = _job()
+
+    output_dir = str(tmp_path / "out")
+    assert generate_batch(layout, data, output_dir, formats=("pdf", "png"), workers=2,
+                          chunk_size=5) == 40
+
+    records = Manifest(output_dir).load().records
+    assert len(records) == 40
+    for record in records.values():
+        assert record['status'] == "done"
+        assert set(record['outputs']) == {"pdf", "png"}
+        for entry in record['outputs'].values():
+            assert os.path.getsize(os.path.join(output_dir, entry['file'])) == entry['size']
+
+def test_encoders_never_save_one_image_at_once(tmp_path, monkeypatch):
+    # Pillow keeps a save's settings on the Image, so overlapping saves of one
+    # image race; make every save slow enough that an overlap is caught
+    saving = set()
+    save = Image.Image.save
+
+    def checked_save(img, *args, **kwargs):
+        assert id(img) not in saving, "two encoders saving one image"
+        saving.add(id(img))
+        try:
+            time.sleep(0.005)
+            return save(img, *args, **kwargs)
+        finally:
+            saving.discard(id(img))
+
+    monkeypatch.setattr(Image.Image, "save", checked_save)
+    layout, data = _job(rows=12)
+    assert generate_batch(layout, data, str(tmp_path / "out"), formats=("pdf", "png"),
+                          workers=1) == 12